@@ -0,0 +1,217 @@
+"""
+Throughput benchmarks for the environment, inference, training,
+evaluation and checkpoint loading, on CPU and without any downloads.
+
+Every benchmark that involves a Policy is run for each hidden size (64,
+128 and 256 by default, as in the part5a plots). Results are written as
+JSON, and a later run can be compared against a saved baseline:
+
+    python bench.py --save bench-baseline.json
+    python bench.py --compare bench-baseline.json
+"""
+from __future__ import print_function
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from timeit import default_timer
+import numpy as np
+import torch
+
+import checkpoints
+import exact
+import states
+import tictactoe
+from tictactoe import Environment, Policy, VecEnvironment
+
+
+def measure(fn, min_time=0.2, repeat=3):
+    """
+    Best time per call of fn over repeat rounds of at least min_time
+    seconds each.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        calls = 0
+        start = default_timer()
+        while True:
+            fn()
+            calls += 1
+            elapsed = default_timer() - start
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / calls)
+    return best
+
+
+def bench_env(scale):
+    """
+    Moves per second of Environment.step/check_win and VecEnvironment.
+    Every timed move is legal, so the rates are of placed marks rather
+    than of invalid-move rejections.
+    """
+    env = Environment()
+    # whole random games of at least 1000 legal moves in all
+    games = []
+    while sum(len(g) for g in games) < 1000:
+        env.reset()
+        game = []
+        while not env.done:
+            game.append(random.choice(states.legal_moves(env.state)))
+            env.step(game[-1])
+        games.append(game)
+    num_moves = sum(len(g) for g in games)
+
+    def steps():
+        for game in games:
+            env.reset()
+            for a in game:
+                env.step(a)
+
+    def wins():
+        for _ in range(1000):
+            env.check_win()
+
+    venv = VecEnvironment(1024)
+
+    def vec_steps():
+        # a random legal cell of every board
+        legal = states.LEGAL[venv.state]
+        venv.play_against_random(
+            (np.random.random_sample(legal.shape) * legal).argmax(1))
+
+    return {
+        'env_step_moves_per_sec': num_moves / measure(steps, 0.2 * scale),
+        'check_win_per_sec': 1000 / measure(wins, 0.2 * scale),
+        'vec_env_moves_per_sec': 1024 / measure(vec_steps, 0.2 * scale),
+    }
+
+
+def bench_policy(hidden_size, scale, workdir):
+    """Inference, training, evaluation and loading for one hidden size."""
+    policy = Policy(hidden_size=hidden_size)
+    env = Environment()
+    grids = np.zeros((1024, 9), dtype=np.int64)
+    result = {}
+
+    with torch.no_grad():
+        result['select_action_latency_us'] = 1e6 * measure(
+            lambda: tictactoe.select_action(policy, env.grid), 0.2 * scale)
+        result['select_actions_1024_per_sec'] = 1024 / measure(
+            lambda: tictactoe.select_actions(policy, grids), 0.2 * scale)
+
+    episodes = max(20, int(200 * scale))
+    # with this log_interval train() never checkpoints; if it did, the
+    # store would still be in workdir rather than in the tree
+    store = os.path.join(workdir, 'train-%d.bin' % hidden_size)
+    with contextlib.redirect_stdout(io.StringIO()):
+        # warm up autograd and the optimizer before timing
+        tictactoe.train(Policy(hidden_size=hidden_size), env,
+                        log_interval=10 ** 9, num_episodes=5, store=store)
+        start = default_timer()
+        tictactoe.train(policy, env, log_interval=10 ** 9,
+                        num_episodes=episodes, store=store)
+        # train() stops after the first batch past num_episodes
+        result['train_episodes_per_sec'] = (
+            (episodes + 1) / (default_timer() - start))
+        batched = max(1000, int(10000 * scale))
+        start = default_timer()
+        tictactoe.train(policy, env, log_interval=10 ** 9, batch_size=100,
+                        num_episodes=batched, store=store)
+        result['train_batch100_episodes_per_sec'] = (
+            (batched // 100 + 1) * 100 / (default_timer() - start))
+
+    result['rate_100_games_sec'] = measure(
+        lambda: tictactoe.rate(env, policy), 0.2 * scale)
+    result['evaluate_20000_games_sec'] = measure(
+        lambda: tictactoe.evaluate(policy, 20000), 0.2 * scale, repeat=1)
+    result['exact_rate_sec'] = measure(
+        lambda: exact.exact_rate(policy), 0.2 * scale)
+
+    path = os.path.join(workdir, 'policy-%d.pkl' % hidden_size)
+    torch.save(policy.state_dict(), path)
+    store = checkpoints.CheckpointStore(
+        os.path.join(workdir, 'checkpoints-%d.bin' % hidden_size))
+    store.add(policy.state_dict(), 1000)
+    result['load_pickle_ms'] = 1e3 * measure(
+        lambda: policy.load_state_dict(torch.load(path)), 0.2 * scale)
+    result['load_store_ms'] = 1e3 * measure(
+        lambda: store.load_into(policy, 1000), 0.2 * scale)
+    return result
+
+
+def run(hidden_sizes=(64, 128, 256), scale=1.0):
+    """All benchmarks, as a JSON-serializable dict."""
+    random.seed(0)
+    np.random.seed(0)
+    torch.manual_seed(0)
+    workdir = tempfile.mkdtemp()
+    try:
+        results = {'env': bench_env(scale), 'policy': {}}
+        for h in hidden_sizes:
+            results['policy'][str(h)] = bench_policy(h, scale, workdir)
+    finally:
+        shutil.rmtree(workdir)
+    results['meta'] = {'python': platform.python_version(),
+                       'torch': torch.__version__,
+                       'numpy': np.__version__,
+                       'machine': platform.machine(),
+                       'threads': torch.get_num_threads(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    return results
+
+
+def _flatten(results):
+    flat = dict(('env.' + k, v) for k, v in results['env'].items())
+    for h, metrics in results['policy'].items():
+        flat.update(('h%s.%s' % (h, k), v) for k, v in metrics.items())
+    return flat
+
+
+def compare(results, baseline):
+    """
+    Print every metric next to its baseline value. Metrics ending in
+    _per_sec are better when higher, times are better when lower; the
+    last column is the speedup over the baseline either way.
+    """
+    new, old = _flatten(results), _flatten(baseline)
+    for key in sorted(new):
+        if key not in old:
+            print('{:<45} {:>14.4g} {:>14} {:>8}'.format(key, new[key], '-',
+                                                         '-'))
+            continue
+        if key.endswith('_per_sec'):
+            speedup = new[key] / old[key]
+        else:
+            speedup = old[key] / new[key]
+        print('{:<45} {:>14.4g} {:>14.4g} {:>7.2f}x'.format(
+            key, new[key], old[key], speedup))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--hidden', type=int, nargs='+',
+                        default=[64, 128, 256])
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply benchmark durations by this')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare to')
+    args = parser.parse_args()
+
+    results = run(args.hidden, args.scale)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
@@ -7,97 +7,14 @@ import random
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-import torch.optim as optim
 import torch.distributions
-from torch.autograd import Variable
-
-
-class Environment(object):
-    """
-    The Tic-Tac-Toe Environment
-    """
-    # possible ways to win
-    win_set = frozenset([(0, 1, 2), (3, 4, 5), (6, 7, 8),  # horizontal
-                         (0, 3, 6), (1, 4, 7), (2, 5, 8),  # vertical
-                         (0, 4, 8), (2, 4, 6)])  # diagonal
-    # statuses
-    STATUS_VALID_MOVE = 'valid'
-    STATUS_INVALID_MOVE = 'inv'
-    STATUS_WIN = 'win'
-    STATUS_TIE = 'tie'
-    STATUS_LOSE = 'lose'
-    STATUS_DONE = 'done'
-
-    def __init__(self):
-        self.reset()
-
-    def reset(self):
-        """Reset the game to an empty board."""
-        self.grid = np.array([0] * 9)  # grid
-        self.turn = 1  # whose turn it is
-        self.done = False  # whether game is done
-        return self.grid
-
-    def render(self):
-        """Print what is on the board."""
-        map = {0: '.', 1: 'x', 2: 'o'}  # grid label vs how to plot
-        print(''.join(map[i] for i in self.grid[0:3]))
-        print(''.join(map[i] for i in self.grid[3:6]))
-        print(''.join(map[i] for i in self.grid[6:9]))
-        print('====')
-
-    def check_win(self):
-        """Check if someone has won the game."""
-        for pos in self.win_set:
-            s = set([self.grid[p] for p in pos])
-            if len(s) == 1 and (0 not in s):
-                return True
-        return False
-
-    def step(self, action):
-        """Mark a point on position action."""
-        assert type(action) == int and action >= 0 and action < 9
-        # done = already finished the game
-        if self.done:
-            return self.grid, self.STATUS_DONE, self.done
-        # action already have something on it
-        if self.grid[action] != 0:
-            return self.grid, self.STATUS_INVALID_MOVE, self.done
-        # play move
-        self.grid[action] = self.turn
-        if self.turn == 1:
-            self.turn = 2
-        else:
-            self.turn = 1
-        # check win
-        if self.check_win():
-            self.done = True
-            return self.grid, self.STATUS_WIN, self.done
-        # check tie
-        if all([p != 0 for p in self.grid]):
-            self.done = True
-            return self.grid, self.STATUS_TIE, self.done
-        return self.grid, self.STATUS_VALID_MOVE, self.done
-
-    def random_step(self):
-        """Choose a random, unoccupied move on the board to play."""
-        pos = [i for i in range(9) if self.grid[i] == 0]
-        move = random.choice(pos)
-        return self.step(move)
-
-    def play_against_random(self, action):
-        """Play a move, and then have a random agent play the next move."""
-        state, status, done = self.step(action)
-        if not done and self.turn == 2:
-            state, s2, done = self.random_step()
-            if done:
-                if s2 == self.STATUS_WIN:
-                    status = self.STATUS_LOSE
-                elif s2 == self.STATUS_TIE:
-                    status = self.STATUS_TIE
-                else:
-                    raise ValueError("???")
-        return state, status, done
+from tictactoe import (Environment, _make_optimizer, collect_episodes,
+                       compute_returns, crossed_interval, encode_inputs,
+                       finish_batch, first_move_distr, log_progress,
+                       select_action, select_actions)
+import checkpoints
+import inference
+import states
 
 
 class Policy(nn.Module):
@@ -116,37 +33,6 @@ class Policy(nn.Module):
         return F.softmax(action_scores, dim=1)
 
 
-def select_action(policy, state):
-    """Samples an action from the policy at the state."""
-    state = torch.from_numpy(state).long().unsqueeze(0)
-    state = torch.zeros(3, 9).scatter_(0, state, 1).view(1, 27)
-    pr = policy(Variable(state))
-    m = torch.distributions.Categorical(pr)
-    action = m.sample()
-    log_prob = torch.sum(m.log_prob(action))
-    return action.data[0], log_prob
-
-
-def compute_returns(rewards, gamma=1.0):
-    """
-    Compute returns for each time step, given the rewards
-      @param rewards: list of floats, where rewards[t] is the reward
-                      obtained at time step t
-      @param gamma: the discount factor
-      @returns list of floats representing the episode's returns
-          G_t = r_t + \gamma r_{t+1} + \gamma^2 r_{t+2} + ...
-
-    """
-    R = np.array(rewards)
-    steps = np.array(list(range(len(rewards))))
-    gammas = np.array([gamma] * len(rewards))
-    powers = np.power(gammas, steps)
-    G_ts = []
-    for i in range(len(rewards)):
-        G_ts.append(np.dot(R[i:].T, powers[:len(rewards) - i]))
-    return G_ts
-
-
 def finish_episode(saved_rewards, saved_logprobs, gamma=1.0):
     """Samples an action from the policy at the state."""
     policy_loss = []
@@ -176,9 +62,7 @@ def get_reward(status):
 
 def train(policy, env, gamma=1.0, log_interval=5000):
     """Train policy gradient."""
-    optimizer = optim.Adam(policy.parameters(), lr=0.001)
-    scheduler = torch.optim.lr_scheduler.StepLR(
-        optimizer, step_size=10000, gamma=0.9)
+    optimizer, scheduler = _make_optimizer(policy)
     running_reward = 0
 
     for i_episode in count(1):
@@ -215,9 +99,7 @@ def train(policy, env, gamma=1.0, log_interval=5000):
 
 def self_train(policy, env, gamma=1.0, log_interval=5000):
     """Train policy gradient."""
-    optimizer = optim.Adam(policy.parameters(), lr=0.001)
-    scheduler = torch.optim.lr_scheduler.StepLR(
-        optimizer, step_size=10000, gamma=0.9)
+    optimizer, scheduler = _make_optimizer(policy)
     running_reward = 0
 
     for i_episode in count(1):
@@ -252,15 +134,6 @@ def self_train(policy, env, gamma=1.0, log_interval=5000):
             optimizer.zero_grad()
 
 
-def first_move_distr(policy, env):
-    """Display the distribution of first moves."""
-    state = env.reset()
-    state = torch.from_numpy(state).long().unsqueeze(0)
-    state = torch.zeros(3, 9).scatter_(0, state, 1).view(1, 27)
-    pr = policy(Variable(state))
-    return pr.data
-
-
 def load_weights(policy, episode):
     """Load saved weights"""
     weights = torch.load("ttt/policy-%d.pkl" % episode)
@@ -276,8 +149,9 @@ def load_weights_from_self(policy, episode):
 def self_play(env, policy, action):
     state, status, done = env.step(action)
     if not done and env.turn == 2:
-        s_action, logp = select_action(policy, env.grid)
-        state, s2, done = env.step(s_action)
+        with torch.no_grad():
+            s_actions, _ = select_actions(policy, env.grid[None])
+        state, s2, done = env.step(int(s_actions[0]))
         if done:
             if s2 == env.STATUS_WIN:
                 status = env.STATUS_LOSE
@@ -288,9 +162,164 @@ def self_play(env, policy, action):
     return state, status, done
 
 
+class League(object):
+    """
+    Frozen Policy snapshots used as self-play opponents.
+
+    The weights of every member are kept stacked, so the replies of all
+    opponents across a batch of games come from one batched forward pass
+    even when each game faces a different member. All members share one
+    hidden size.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.weights = None  # affine1/affine2 weights and biases, stacked
+
+    def __len__(self):
+        return 0 if self.weights is None else self.weights[0].size(0)
+
+    def add(self, policy):
+        """Freeze a copy of policy's current weights into the league."""
+        self.add_state_dict(policy.state_dict())
+
+    def add_state_dict(self, weights):
+        new = [weights[name].detach().clone().unsqueeze(0) for name in
+               ('affine1.weight', 'affine1.bias',
+                'affine2.weight', 'affine2.bias')]
+        if self.weights is None:
+            self.weights = new
+        else:
+            self.weights = [torch.cat([w, n]) for w, n in
+                            zip(self.weights, new)]
+        if self.max_size is not None and len(self) > self.max_size:
+            # drop the oldest snapshot
+            self.weights = [w[1:] for w in self.weights]
+
+    @classmethod
+    def from_checkpoints(cls, directory='ttt', episodes=None, max_size=None):
+        """League of the policy-<episode>.pkl checkpoints in directory."""
+        league = cls(max_size)
+        if episodes is None:
+            import glob
+            import re
+            episodes = sorted(
+                int(re.search(r'(\d+)\.pkl$', p).group(1))
+                for p in glob.glob("%s/policy-*.pkl" % directory))
+        for ep in episodes:
+            league.add_state_dict(
+                torch.load("%s/policy-%d.pkl" % (directory, ep)))
+        return league
+
+    @classmethod
+    def from_store(cls, path="stt/checkpoints.bin", hidden_size=128,
+                   episodes=None, max_size=None):
+        """
+        League of the hidden_size checkpoints in the checkpoint store at
+        path, e.g. the ones league_train and train_parallel write; all of
+        them unless episodes is given. Like add, only the newest max_size
+        are kept.
+        """
+        league = cls(max_size)
+        store = checkpoints.open_store(path)
+        if episodes is None:
+            episodes = store.episodes(hidden_size)
+        if max_size is not None:
+            episodes = list(episodes)[len(episodes) - max_size:]
+        if len(episodes) > 0:
+            stacked = dict(store.stack(hidden_size, episodes))
+            # copy out of the read-only mapping so the league owns them
+            league.weights = [torch.from_numpy(np.array(stacked[name]))
+                              for name in ('affine1.weight', 'affine1.bias',
+                                           'affine2.weight', 'affine2.bias')]
+        return league
+
+    def sample(self, n):
+        """Indices of n opponents drawn uniformly from the league."""
+        return np.random.randint(len(self), size=n)
+
+    def select_actions(self, opponents, state_ids):
+        """
+        One legal move per board, each from the member in opponents.
+        Moves are sampled from the member's distribution restricted to
+        the empty cells, so frozen opponents never stall a game.
+        """
+        w1, b1, w2, b2 = [w[torch.from_numpy(opponents)]
+                          for w in self.weights]
+        x = encode_inputs(state_ids)
+        with torch.no_grad():
+            h = F.relu(torch.bmm(w1, x.unsqueeze(2)).squeeze(2) + b1)
+            scores = torch.bmm(w2, h.unsqueeze(2)).squeeze(2) + b2
+            pr = F.softmax(scores, dim=1).numpy().astype(np.float64)
+        legal = states.LEGAL[state_ids]
+        pr = pr * legal + 1e-12 * legal
+        pr /= pr.sum(1, keepdims=True)
+        return inference.sample_moves(pr)
+
+
+def league_play(venv, league, opponents, actions):
+    """
+    self_play for a VecEnvironment: play the agent's move on every board,
+    then a reply from each board's league opponent where one is due.
+    """
+    return venv.play_against(
+        actions,
+        lambda rows: league.select_actions(opponents[rows], venv.state[rows]))
+
+
+def league_train(policy, league, gamma=1.0, log_interval=5000,
+                 batch_size=50, snapshot_interval=5000, num_episodes=None,
+                 store="stt/checkpoints.bin"):
+    """
+    Train policy gradient by batched self-play against a league of frozen
+    checkpoints: every batch plays batch_size games side by side, each
+    against an opponent drawn from the league, and a snapshot of the
+    policy joins the league every snapshot_interval episodes. Checkpoints
+    go to the checkpoint store at path store, as in parallel.py.
+    """
+    optimizer, scheduler = _make_optimizer(policy, batch_size)
+    if len(league) == 0:
+        league.add(policy)
+    running_reward = 0
+    running_episodes = 0
+    env = Environment()
+
+    for i_batch in count(1):
+        i_episode = i_batch * batch_size
+        opponents = league.sample(batch_size)
+        saved_logprobs, saved_rewards, mask = collect_episodes(
+            policy, batch_size,
+            play=lambda venv, actions: league_play(venv, league, opponents,
+                                                   actions),
+            reward=get_reward)
+        running_reward += saved_rewards.sum()
+        running_episodes += batch_size
+
+        finish_batch(saved_rewards, saved_logprobs, mask, gamma)
+        del saved_logprobs
+        optimizer.step()
+        scheduler.step()
+        optimizer.zero_grad()
+
+        if crossed_interval(i_episode, batch_size,
+                            snapshot_interval) is not None:
+            league.add(policy)
+
+        log_episode = crossed_interval(i_episode, batch_size, log_interval)
+        if log_episode is not None:
+            log_progress(policy, log_episode,
+                         running_reward / running_episodes, store, env)
+            running_reward = 0
+            running_episodes = 0
+
+        if num_episodes is not None and i_episode >= num_episodes:
+            break
+
+
 def baby_play(env, policy):
-    action, logp = select_action(policy, env.grid)
-    env.step(action)
+    with torch.no_grad():
+        actions, _ = select_actions(policy, env.grid[None])
+    env.step(int(actions[0]))
     env.render()
 
 
@@ -316,6 +345,15 @@ if __name__ == '__main__':
         # `python tictactoe.py` to train the agent
         load_weights(policy, 150000)
         self_train(policy, env)
+    elif sys.argv[1] == 'l':
+        # `python bonus.py l` to train against a league of ttt/ checkpoints,
+        # `python bonus.py l <store>` against those of a checkpoint store
+        load_weights(policy, 150000)
+        if len(sys.argv) > 2:
+            league = League.from_store(sys.argv[2], max_size=50)
+        else:
+            league = League.from_checkpoints('ttt', max_size=50)
+        league_train(policy, league)
     else:
         # `python tictactoe.py <ep>` to print the first move distribution
         # using weightt checkpoint at episode int(<ep>)
@@ -0,0 +1,311 @@
+"""
+Single-file, memory-mapped store for Policy checkpoints.
+
+Layout of a store file:
+
+    8 bytes   magic, b'TTTCKPT1'
+    8 bytes   little-endian uint64 offset of the index
+    ...       float32 tensor region: one contiguous block per checkpoint,
+              holding its parameters flattened in state_dict order
+    ...       index: JSON list of {"hidden", "episode", "offset", "params",
+              "mask_illegal"} entries, "params" being the [name, shape]
+              of each tensor and "mask_illegal" the Policy flag the
+              checkpoint was trained with (missing means False)
+
+The tensor region is memory-mapped, so reading a checkpoint, or a stack
+of all checkpoints of one hidden size, is a slice of the mapping rather
+than a pickle load. New checkpoints are appended before the index, which
+is then rewritten. The header only ever points at a complete index: a
+copy of the current index is first written past the end of the new data
+and index and the header pointed at it, so an add that is interrupted
+(e.g. by Ctrl-C during training) leaves every earlier checkpoint intact.
+An add holds an exclusive lock on the file and first reloads the index,
+so several stores, in one process or several, can add to one file.
+
+`python checkpoints.py <store> <pickle-glob>` to import torch.save pickles
+"""
+from __future__ import print_function
+import glob
+import json
+import os
+import re
+import struct
+import numpy as np
+try:
+    import fcntl
+except ImportError:  # Windows: adds are not locked against each other
+    fcntl = None
+
+DEFAULT_PATH = "testing/checkpoints.bin"
+MAGIC = b'TTTCKPT1'
+_HEADER = struct.Struct('<8sQ')
+
+
+def _read_header(f):
+    """(magic, index offset) at the start of an open store file."""
+    f.seek(0)
+    return _HEADER.unpack(f.read(_HEADER.size))
+
+
+def _write_header(f, index_offset):
+    """Point the header at index_offset once everything before is on disk."""
+    f.flush()
+    os.fsync(f.fileno())
+    f.seek(0)
+    f.write(_HEADER.pack(MAGIC, index_offset))
+    f.flush()
+
+
+class CheckpointStore(object):
+    """
+    Checkpoints keyed by (hidden size, episode) in one file.
+    >>> import tempfile
+    >>> from collections import OrderedDict
+    >>> path = os.path.join(tempfile.mkdtemp(), 'checkpoints.bin')
+    >>> def weights(v):
+    ...     return OrderedDict([('w', np.full((2, 3), v)), ('b', [v, v])])
+    >>> store = CheckpointStore(path)
+    >>> store.add(weights(1), 1000)
+    >>> store.add(weights(2), 2000)
+    >>> store.add(weights(3), 1000)
+    >>> store.add(weights(4), 3000, mask_illegal=True)
+    >>> store = CheckpointStore(path)
+    >>> store.keys()
+    [(2, 1000), (2, 2000), (2, 3000)]
+    >>> store.mask_illegal(2, 1000), store.mask_illegal(2, 3000)
+    (False, True)
+    >>> [(name, a.tolist()) for name, a in store.arrays(2, 1000)]
+    [('w', [[3.0, 3.0, 3.0], [3.0, 3.0, 3.0]]), ('b', [3.0, 3.0])]
+    >>> dict(store.stack(2))['b'].tolist()
+    [[3.0, 3.0], [2.0, 2.0], [4.0, 4.0]]
+
+    Several stores, in one process or more, can add to the same file:
+    >>> path = os.path.join(tempfile.mkdtemp(), 'checkpoints.bin')
+    >>> a, b = CheckpointStore(path), CheckpointStore(path)
+    >>> a.add(weights(1), 1000)
+    >>> b.add(OrderedDict([('w', np.full((3, 3), 2.0))]), 1000)
+    >>> a.add(weights(3), 2000)
+    >>> store = CheckpointStore(path)
+    >>> store.keys()
+    [(2, 1000), (2, 2000), (3, 1000)]
+    >>> [float(store.flat(*key)[0]) for key in store.keys()]
+    [1.0, 3.0, 2.0]
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(_HEADER.pack(MAGIC, _HEADER.size))
+                f.write(b'[]')
+        self._load()
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            magic, index_offset = _read_header(f)
+            if magic != MAGIC:
+                raise ValueError("%s is not a checkpoint store" % self.path)
+            f.seek(index_offset)
+            # anything after the index is left over from an interrupted add
+            entries, _ = json.JSONDecoder().raw_decode(
+                f.read().decode('utf-8', 'replace'))
+        self._index_offset = index_offset
+        self._entries = dict(((e['hidden'], e['episode']), e)
+                             for e in entries)
+        self._data = None
+        if index_offset > _HEADER.size:
+            self._data = np.memmap(self.path, dtype=np.float32, mode='r',
+                                   offset=_HEADER.size,
+                                   shape=((index_offset - _HEADER.size) // 4,))
+
+    def keys(self):
+        """Sorted (hidden size, episode) pairs in the store."""
+        return sorted(self._entries)
+
+    def episodes(self, hidden_size):
+        """Sorted episodes stored for the given hidden size."""
+        return sorted(e for h, e in self._entries if h == hidden_size)
+
+    def __contains__(self, key):
+        return tuple(key) in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, state_dict, episode, mask_illegal=False):
+        """
+        Store a Policy state_dict (torch tensors or arrays) as episode,
+        with the policy's mask_illegal flag. An existing checkpoint with
+        the same key is overwritten in place.
+        """
+        params = [(name, np.asarray(t.detach().cpu() if hasattr(t, 'detach')
+                                    else t, dtype=np.float32))
+                  for name, t in state_dict.items()]
+        hidden = int(params[0][1].shape[0])
+        data = b''.join(np.ascontiguousarray(p).tobytes() for _, p in params)
+        with open(self.path, 'r+b') as f:
+            # the lock is released when f is closed; under it, reload so
+            # the data of other writers of this file is appended after
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            self._load()
+            self._add(f, params, hidden, int(episode), data,
+                      bool(mask_illegal))
+        self._load()
+
+    def _add(self, f, params, hidden, episode, data, mask_illegal):
+        old = self._entries.get((hidden, episode))
+        if (old is not None and
+                self.flat(hidden, episode).nbytes == len(data) and
+                old.get('mask_illegal', False) == mask_illegal):
+            self._data = None  # drop the mapping before writing
+            f.seek(_HEADER.size + old['offset'] * 4)
+            f.write(data)
+            f.flush()
+            return
+        entries = [e for k, e in self._entries.items()
+                   if k != (hidden, episode)]
+        entries.append({'hidden': hidden, 'episode': episode,
+                        'offset': (self._index_offset - _HEADER.size) // 4,
+                        'params': [[name, list(p.shape)]
+                                   for name, p in params],
+                        'mask_illegal': mask_illegal})
+        index = json.dumps(entries).encode('utf-8')
+        index_offset = self._index_offset + len(data)
+        # the data goes over the current index, so move the header to a
+        # copy of it first, past everything written below and aligned for
+        # the float32 data that may follow it after an interrupted add
+        spare = max(os.path.getsize(self.path), index_offset + len(index))
+        spare += -spare % 4
+        self._data = None
+        f.seek(self._index_offset)
+        current = f.read()
+        f.seek(spare)
+        f.write(current)
+        _write_header(f, spare)
+        f.seek(self._index_offset)
+        f.write(data)
+        f.write(index)
+        _write_header(f, index_offset)
+        f.truncate(index_offset + len(index))
+
+    def _stale(self):
+        """Whether another writer has added to the file since _load."""
+        with open(self.path, 'rb') as f:
+            return _read_header(f)[1] != self._index_offset
+
+    def mask_illegal(self, hidden_size, episode):
+        """Whether a checkpoint was trained with Policy.mask_illegal."""
+        return self._entries[(hidden_size, episode)].get('mask_illegal',
+                                                          False)
+
+    def flat(self, hidden_size, episode):
+        """Zero-copy float32 view of all parameters of one checkpoint."""
+        e = self._entries[(hidden_size, episode)]
+        size = sum(int(np.prod(shape)) for _, shape in e['params'])
+        return self._data[e['offset']:e['offset'] + size]
+
+    def arrays(self, hidden_size, episode):
+        """Ordered (name, zero-copy array view) pairs of one checkpoint."""
+        e = self._entries[(hidden_size, episode)]
+        flat = self.flat(hidden_size, episode)
+        out, start = [], 0
+        for name, shape in e['params']:
+            size = int(np.prod(shape))
+            out.append((name, flat[start:start + size].reshape(shape)))
+            start += size
+        return out
+
+    def state_dict(self, hidden_size, episode):
+        """One checkpoint as a state_dict of torch tensors."""
+        import torch
+        from collections import OrderedDict
+        return OrderedDict((name, torch.from_numpy(np.array(a)))
+                           for name, a in self.arrays(hidden_size, episode))
+
+    def load_into(self, policy, episode):
+        """
+        Load a checkpoint into policy, picking the policy's hidden size,
+        and restore its mask_illegal flag.
+        """
+        hidden = next(iter(policy.state_dict().values())).shape[0]
+        policy.load_state_dict(self.state_dict(hidden, episode))
+        if hasattr(policy, 'mask_illegal'):
+            policy.mask_illegal = self.mask_illegal(hidden, episode)
+
+    def stack(self, hidden_size, episodes=None):
+        """
+        Parameters of several checkpoints stacked along a new first axis,
+        as ordered (name, (M, ...) array) pairs. When the checkpoints sit
+        back to back in the file, in order, the arrays are views of the
+        mapping and nothing is copied.
+        """
+        if episodes is None:
+            episodes = self.episodes(hidden_size)
+        entries = [self._entries[(hidden_size, ep)] for ep in episodes]
+        size = self.flat(hidden_size, episodes[0]).size
+        first = entries[0]['offset']
+        if all(e['offset'] == first + i * size for i, e in enumerate(entries)):
+            block = self._data[first:first + len(entries) * size]
+            block = block.reshape(len(entries), size)
+        else:
+            block = np.stack([self.flat(hidden_size, ep) for ep in episodes])
+        out, start = [], 0
+        for name, shape in entries[0]['params']:
+            n = int(np.prod(shape))
+            out.append((name, block[:, start:start + n].reshape(
+                [len(entries)] + list(shape))))
+            start += n
+        return out
+
+
+_open_stores = {}
+
+
+def open_store(path):
+    """
+    CheckpointStore for path, shared between callers in this process, and
+    reloaded if another store or process has added to the file since.
+    """
+    if path not in _open_stores:
+        _open_stores[path] = CheckpointStore(path)
+    elif _open_stores[path]._stale():
+        _open_stores[path]._load()
+    return _open_stores[path]
+
+
+def close_store(path):
+    """Forget the shared CheckpointStore for path, e.g. before deleting it."""
+    store = _open_stores.pop(path, None)
+    if store is not None:
+        store._data = None
+
+
+def import_pickles(store, pattern="testing/policy-*.pkl"):
+    """
+    Add every torch.save checkpoint matching pattern (named like
+    policy-<episode>.pkl) to store, in episode order; already stored
+    checkpoints are skipped. Returns the number imported.
+    """
+    import torch
+    paths = []
+    for path in glob.glob(pattern):
+        match = re.search(r'(\d+)\.pkl$', path)
+        if match:
+            paths.append((int(match.group(1)), path))
+    imported = 0
+    for episode, path in sorted(paths):
+        weights = torch.load(path)
+        hidden = next(iter(weights.values())).shape[0]
+        if (hidden, episode) not in store:
+            store.add(weights, episode)
+            imported += 1
+    return imported
+
+
+if __name__ == '__main__':
+    import sys
+
+    store = CheckpointStore(sys.argv[1])
+    n = import_pickles(store, sys.argv[2])
+    print("Imported %d checkpoints into %s" % (n, sys.argv[1]))
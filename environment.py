@@ -0,0 +1,497 @@
+"""
+The Tic-Tac-Toe environment, single-board and vectorized, and the m,n,k
+generalization for larger boards.
+
+Only numpy is needed here, so tools that just play or query saved
+policies (see inference.py) can use the environment without importing
+torch. tictactoe.py re-exports these classes and make_environment.
+"""
+from __future__ import print_function
+import random
+import numpy as np
+
+import solver
+import states
+
+
+class Environment(object):
+    """
+    The Tic-Tac-Toe Environment
+
+    The board is tracked both as self.grid and as its base-3 state id
+    self.state (see states.py); moves, wins and ties are table lookups on
+    the id. Opponent moves are drawn from self.rng, the random module
+    unless an instance is given its own random.Random.
+    """
+    # possible ways to win
+    win_set = frozenset([(0, 1, 2), (3, 4, 5), (6, 7, 8),  # horizontal
+                         (0, 3, 6), (1, 4, 7), (2, 5, 8),  # vertical
+                         (0, 4, 8), (2, 4, 6)])  # diagonal
+    # statuses
+    STATUS_VALID_MOVE = 'valid'
+    STATUS_INVALID_MOVE = 'inv'
+    STATUS_WIN = 'win'
+    STATUS_TIE = 'tie'
+    STATUS_LOSE = 'lose'
+    STATUS_DONE = 'done'
+    # board shape, k in a row to win, and the Policy sizes that follow
+    m = n = k = 3
+    gravity = False
+    num_cells = 9
+    num_actions = 9
+    rng = random
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Reset the game to an empty board."""
+        return self.set_state(states.EMPTY_STATE)
+
+    def set_state(self, state):
+        """Jump to the board with the given state id."""
+        self.state = int(state)  # base-3 state id
+        self.grid = states.decode(self.state)  # grid
+        self.turn = int(states.TURN[self.state])  # whose turn it is
+        self.done = bool(states.TERMINAL[self.state])  # whether game is done
+        return self.grid
+
+    def render(self):
+        """Print what is on the board."""
+        map = {0: '.', 1: 'x', 2: 'o'}  # grid label vs how to plot
+        print(''.join(map[i] for i in self.grid[0:3]))
+        print(''.join(map[i] for i in self.grid[3:6]))
+        print(''.join(map[i] for i in self.grid[6:9]))
+        print('====')
+
+    def check_win(self):
+        """Check if someone has won the game."""
+        return states.WINNER[self.state] != 0
+
+    def step(self, action):
+        """Mark a point on position action."""
+        assert type(action) == int and action >= 0 and action < 9
+        # done = already finished the game
+        if self.done:
+            return self.grid, self.STATUS_DONE, self.done
+        # action already have something on it
+        nxt = states.NEXT[self.state, action]
+        if nxt == self.state:
+            return self.grid, self.STATUS_INVALID_MOVE, self.done
+        # play move
+        self.grid[action] = self.turn
+        self.state = int(nxt)
+        self.turn = 3 - self.turn
+        # check win
+        if states.WINNER[nxt]:
+            self.done = True
+            return self.grid, self.STATUS_WIN, self.done
+        # check tie
+        if states.TIE[nxt]:
+            self.done = True
+            return self.grid, self.STATUS_TIE, self.done
+        return self.grid, self.STATUS_VALID_MOVE, self.done
+
+    def random_step(self):
+        """Choose a random, unoccupied move on the board to play."""
+        pos = states.legal_moves(self.state)
+        move = self.rng.choice(pos)
+        return self.step(move)
+
+    def solver_step(self):
+        """Choose a random optimal move (see solver.py) to play."""
+        move = self.rng.choice(solver.best_moves(self.state))
+        return self.step(move)
+
+    def play_against_random(self, action):
+        """Play a move, and then have a random agent play the next move."""
+        return self._play_against(action, self.random_step)
+
+    def play_against_solver(self, action):
+        """Play a move, and then have a perfect player play the next move."""
+        return self._play_against(action, self.solver_step)
+
+    def _play_against(self, action, opponent_step):
+        state, status, done = self.step(action)
+        if not done and self.turn == 2:
+            state, s2, done = opponent_step()
+            if done:
+                if s2 == self.STATUS_WIN:
+                    status = self.STATUS_LOSE
+                elif s2 == self.STATUS_TIE:
+                    status = self.STATUS_TIE
+                else:
+                    raise ValueError("???")
+        return state, status, done
+
+
+class VecEnvironment(object):
+    """
+    N Tic-Tac-Toe Environments stepped together as one (N, 9) array.
+
+    Statuses are returned per board as an object array holding the same
+    Environment.STATUS_* strings. With autoreset=True, boards that finish
+    during a call are reset before it returns, so the returned state row
+    is already the fresh board; otherwise finished boards stay done and
+    report STATUS_DONE until reset(). Opponent moves are drawn from rng,
+    a numpy RandomState, the global one by default. Inside a step the
+    statuses are kept as CODE_* integers, which STATUSES maps to the
+    strings; play_rows_against_random hands them back as they are.
+
+    Replaying the same moves and replies on Environments gives the same
+    statuses and boards:
+    >>> rng = np.random.RandomState(0)
+    >>> venv = VecEnvironment(50, autoreset=False)
+    >>> envs = [Environment() for _ in range(50)]
+    >>> replies = {}
+    >>> def choose(rows):
+    ...     legal = states.LEGAL[venv.state[rows]]
+    ...     cells = (rng.random_sample(legal.shape) * legal).argmax(1)
+    ...     replies.update(zip(rows.tolist(), cells.tolist()))
+    ...     return cells
+    >>> seen, mismatches = set(), 0
+    >>> while not venv.done.all():
+    ...     actions = rng.randint(9, size=50)
+    ...     replies.clear()
+    ...     _, status, _ = venv.play_against(actions, choose)
+    ...     for i, env in enumerate(envs):
+    ...         _, s, done = env._play_against(
+    ...             int(actions[i]), lambda: env.step(replies[i]))
+    ...         seen.add(s)
+    ...         if (s != status[i] or done != venv.done[i] or
+    ...                 (env.grid != venv.grid[i]).any()):
+    ...             mismatches += 1
+    >>> sorted(seen), mismatches
+    (['done', 'inv', 'lose', 'tie', 'valid', 'win'], 0)
+
+    With autoreset, a board that finishes comes back already fresh:
+    >>> venv = VecEnvironment(2)
+    >>> for actions in ([0, 0], [3, 1], [1, 3], [4, 2]):
+    ...     _ = venv.step(actions)
+    >>> grid, status, finished = venv.step([2, 8])
+    >>> status.tolist(), finished.tolist()
+    (['win', 'valid'], [True, False])
+    >>> grid.tolist()
+    [[0, 0, 0, 0, 0, 0, 0, 0, 0], [1, 2, 2, 1, 0, 0, 0, 0, 1]]
+    >>> bool(venv.state[0] == states.EMPTY_STATE), venv.done.tolist()
+    (True, [False, False])
+    """
+
+    # statuses inside a step, as indices into STATUSES
+    (CODE_VALID_MOVE, CODE_INVALID_MOVE, CODE_WIN, CODE_TIE, CODE_LOSE,
+     CODE_DONE) = range(6)
+    STATUSES = np.array([Environment.STATUS_VALID_MOVE,
+                         Environment.STATUS_INVALID_MOVE,
+                         Environment.STATUS_WIN, Environment.STATUS_TIE,
+                         Environment.STATUS_LOSE, Environment.STATUS_DONE],
+                        dtype=object)
+
+    def __init__(self, num_envs, autoreset=True, rng=None):
+        self.num_envs = num_envs
+        self.autoreset = autoreset
+        self.rng = np.random if rng is None else rng
+        self.reset()
+
+    def reset(self):
+        """Reset every board to an empty grid."""
+        self.state = np.full(self.num_envs, states.EMPTY_STATE, dtype=np.int64)
+        self.grid = np.zeros((self.num_envs, 9), dtype=np.int64)
+        self.turn = np.ones(self.num_envs, dtype=np.int64)
+        self.done = np.zeros(self.num_envs, dtype=bool)
+        return self.grid
+
+    def reset_boards(self, rows):
+        """Reset only the boards selected by rows (mask or indices)."""
+        self.state[rows] = states.EMPTY_STATE
+        self.grid[rows] = 0
+        self.turn[rows] = 1
+        self.done[rows] = False
+        return self.grid
+
+    def set_state(self, state):
+        """Jump every board to the given (N,) state ids."""
+        self.state = np.array(state, dtype=np.int64).reshape(self.num_envs)
+        self.grid = states.decode(self.state)
+        self.turn = states.TURN[self.state].astype(np.int64)
+        self.done = states.TERMINAL[self.state].copy()
+        return self.grid
+
+    def render(self, row=0):
+        """Print what is on one of the boards."""
+        map = {0: '.', 1: 'x', 2: 'o'}
+        for r in range(3):
+            print(''.join(map[i] for i in self.grid[row, 3 * r:3 * r + 3]))
+        print('====')
+
+    def check_win(self):
+        """Boolean mask of the boards that have three in a row."""
+        return states.WINNER[self.state] != 0
+
+    def _place(self, rows, cells):
+        """Mark cells on rows for whoever's turn it is; return (win, tie)."""
+        nxt = states.NEXT[self.state[rows], cells]
+        self.state[rows] = nxt
+        self.grid[rows, cells] = self.turn[rows]
+        self.turn[rows] = 3 - self.turn[rows]
+        win = states.WINNER[nxt] != 0
+        tie = states.TIE[nxt]
+        self.done[rows] = win | tie
+        return win, tie
+
+    def _step_rows(self, rows, actions):
+        """
+        Play actions on the live boards at row indices rows; returns their
+        CODE_* statuses and the positions in rows that placed a mark.
+        """
+        codes = np.full(len(rows), self.CODE_INVALID_MOVE, dtype=np.int8)
+        placed = np.flatnonzero(states.LEGAL[self.state[rows], actions])
+        win, tie = self._place(rows[placed], actions[placed])
+        codes[placed] = self.CODE_VALID_MOVE
+        codes[placed[win]] = self.CODE_WIN
+        codes[placed[tie]] = self.CODE_TIE
+        return codes, placed
+
+    def _play_rows(self, rows, actions, opponent_step):
+        codes, placed = self._step_rows(rows, actions)
+        due = rows[placed]
+        reply = placed[~self.done[due] & (self.turn[due] == 2)]
+        win, tie = opponent_step(rows[reply])
+        codes[reply[win]] = self.CODE_LOSE
+        codes[reply[tie]] = self.CODE_TIE
+        return codes
+
+    def _all_rows(self, actions, play_rows):
+        """Run play_rows on every live board; statuses become strings."""
+        actions = np.asarray(actions, dtype=np.int64).reshape(-1)
+        assert actions.shape == (self.num_envs,)
+        assert ((actions >= 0) & (actions < 9)).all()
+        rows = np.flatnonzero(~self.done)
+        codes = np.full(self.num_envs, self.CODE_DONE, dtype=np.int8)
+        codes[rows] = play_rows(rows, actions[rows])
+        finished = np.zeros(self.num_envs, dtype=bool)
+        finished[rows] = self.done[rows]
+        if self.autoreset:
+            self.reset_boards(finished)
+        return self.grid, self.STATUSES[codes], finished
+
+    def step(self, actions):
+        """Mark one point per board, as Environment.step does."""
+        return self._all_rows(
+            actions, lambda rows, a: self._step_rows(rows, a)[0])
+
+    def play_rows_against_random(self, rows, actions):
+        """
+        play_against_random for just the boards at row indices rows, none
+        of them done, with one action each. Returns their statuses as
+        CODE_* integers and never resets a board, so a loop that drops
+        the rows that finish only pays for the games still going.
+        """
+        return self._play_rows(np.asarray(rows, dtype=np.int64),
+                               np.asarray(actions, dtype=np.int64),
+                               self.random_step)
+
+    def random_step(self, rows):
+        """Play a uniformly random unoccupied move on each of rows."""
+        legal = states.LEGAL[self.state[rows]]
+        noise = self.rng.random_sample(legal.shape) * legal
+        return self._place(rows, noise.argmax(1))
+
+    def solver_step(self, rows):
+        """Play a random optimal move (see solver.py) on each of rows."""
+        scores = solver.move_values(self.state[rows])
+        best = scores == scores.max(1, keepdims=True)
+        noise = self.rng.random_sample(best.shape) * best
+        return self._place(rows, noise.argmax(1))
+
+    def play_against_random(self, actions):
+        """Play one move per board, then a random reply where one is due."""
+        return self._play_against(actions, self.random_step)
+
+    def play_against_solver(self, actions):
+        """Play one move per board, then a perfect reply where one is due."""
+        return self._play_against(actions, self.solver_step)
+
+    def play_against(self, actions, choose):
+        """
+        Play one move per board, then, where a reply is due, the legal
+        cells picked by choose(rows) for the boards at those row indices.
+        """
+        return self._play_against(
+            actions, lambda rows: self._place(rows, choose(rows)))
+
+    def _play_against(self, actions, opponent_step):
+        return self._all_rows(
+            actions,
+            lambda rows, a: self._play_rows(rows, a, opponent_step))
+
+
+class MNKEnvironment(object):
+    """
+    An m x n board where k in a row (horizontally, vertically or
+    diagonally) wins; with gravity, an action is a column and the mark
+    drops to the lowest empty cell of it, as in Connect Four (m=6, n=7,
+    k=4).
+
+    Cells are numbered row by row from the top left. Only the lines
+    through the last placed cell are checked for a win, walking at most
+    k - 1 cells each way along each of the 4 directions, and a tie is a
+    full move count. Statuses and play_against_random are as for
+    Environment; state ids and the solver only cover the 3x3 board, so
+    there is no set_state or play_against_solver. make_environment picks
+    the table-driven Environment for the plain 3x3 game.
+
+    On the 3x3 board it matches Environment move for move, invalid moves
+    included:
+    >>> rng = random.Random(0)
+    >>> mismatches = 0
+    >>> for _ in range(2000):
+    ...     a, b = Environment(), MNKEnvironment()
+    ...     while not a.done:
+    ...         move = rng.randrange(9)
+    ...         if (a.step(move)[1:] != b.step(move)[1:] or
+    ...                 (a.grid != b.grid).any()):
+    ...             mismatches += 1
+    >>> mismatches
+    0
+
+    k below the board size, walks that stop at the edge instead of
+    wrapping to the next row, and anti-diagonals won from either end or
+    the middle:
+    >>> def play(env, moves):
+    ...     return [env.step(move)[1] for move in moves]
+    >>> play(MNKEnvironment(5, 5, 3), [3, 10, 4, 11, 5, 12])
+    ['valid', 'valid', 'valid', 'valid', 'valid', 'win']
+    >>> play(MNKEnvironment(5, 5, 3), [4, 0, 8, 1, 12])[-1]
+    'win'
+    >>> play(MNKEnvironment(5, 5, 3), [4, 0, 12, 1, 8])[-1]
+    'win'
+
+    Gravity drops each mark to the bottom of its column, a full column is
+    an invalid move, and a full board is a tie:
+    >>> env = MNKEnvironment(6, 7, 4, gravity=True)
+    >>> play(env, [0, 1, 0, 1, 0, 1, 0]), env.winner
+    (['valid', 'valid', 'valid', 'valid', 'valid', 'valid', 'win'], 1)
+    >>> env.board[:, :2].tolist()
+    [[0, 0], [0, 0], [1, 0], [1, 2], [1, 2], [1, 2]]
+    >>> env = MNKEnvironment(6, 7, 4, gravity=True)
+    >>> play(env, [3] * 7)[-1], 3 in env.legal_moves()
+    ('inv', False)
+    >>> play(MNKEnvironment(), [0, 1, 2, 4, 3, 5, 7, 6, 8])[-1]
+    'tie'
+    """
+    STATUS_VALID_MOVE = Environment.STATUS_VALID_MOVE
+    STATUS_INVALID_MOVE = Environment.STATUS_INVALID_MOVE
+    STATUS_WIN = Environment.STATUS_WIN
+    STATUS_TIE = Environment.STATUS_TIE
+    STATUS_LOSE = Environment.STATUS_LOSE
+    STATUS_DONE = Environment.STATUS_DONE
+    rng = random
+    _DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+    def __init__(self, m=3, n=3, k=3, gravity=False):
+        if min(m, n, k) < 1 or k > max(m, n):
+            raise ValueError("need m, n, k >= 1 and k <= max(m, n), got "
+                             "%d, %d, %d" % (m, n, k))
+        self.m = m
+        self.n = n
+        self.k = k
+        self.gravity = gravity
+        self.num_cells = m * n
+        self.num_actions = n if gravity else m * n
+        self.reset()
+
+    def reset(self):
+        """Reset the game to an empty board."""
+        self.grid = np.zeros(self.num_cells, dtype=np.int64)
+        self.board = self.grid.reshape(self.m, self.n)  # view of grid
+        self.heights = [0] * self.n  # marks in each column
+        self.moves = 0
+        self.winner = 0
+        self.turn = 1
+        self.done = False
+        return self.grid
+
+    def render(self):
+        """Print what is on the board."""
+        map = {0: '.', 1: 'x', 2: 'o'}
+        for row in self.board:
+            print(''.join(map[i] for i in row))
+        print('=' * max(4, self.n))
+
+    def check_win(self):
+        """Check if someone has won the game."""
+        return self.winner != 0
+
+    def legal_moves(self):
+        """Python list of the actions that place a mark."""
+        if self.done:
+            return []
+        if self.gravity:
+            return [c for c in range(self.n) if self.heights[c] < self.m]
+        return np.flatnonzero(self.grid == 0).tolist()
+
+    def _cell(self, action):
+        """Cell an action marks, or None if it is not a valid move."""
+        if self.gravity:
+            if self.heights[action] == self.m:
+                return None
+            return (self.m - 1 - self.heights[action]) * self.n + action
+        return action if self.grid[action] == 0 else None
+
+    def _wins(self, cell):
+        """Whether the mark on cell completes k in a row."""
+        r, c = divmod(cell, self.n)
+        player = self.grid[cell]
+        board, m, n, k = self.board, self.m, self.n, self.k
+        for dr, dc in self._DIRECTIONS:
+            count = 1
+            for sign in (1, -1):
+                rr, cc = r + sign * dr, c + sign * dc
+                while (count < k and 0 <= rr < m and 0 <= cc < n and
+                       board[rr, cc] == player):
+                    count += 1
+                    rr += sign * dr
+                    cc += sign * dc
+            if count >= k:
+                return True
+        return False
+
+    def step(self, action):
+        """Mark a point on position (or column) action."""
+        assert type(action) == int and 0 <= action < self.num_actions
+        if self.done:
+            return self.grid, self.STATUS_DONE, self.done
+        cell = self._cell(action)
+        if cell is None:
+            return self.grid, self.STATUS_INVALID_MOVE, self.done
+        self.grid[cell] = self.turn
+        if self.gravity:
+            self.heights[action] += 1
+        self.moves += 1
+        if self._wins(cell):
+            self.winner = self.turn
+            self.turn = 3 - self.turn
+            self.done = True
+            return self.grid, self.STATUS_WIN, self.done
+        self.turn = 3 - self.turn
+        if self.moves == self.num_cells:
+            self.done = True
+            return self.grid, self.STATUS_TIE, self.done
+        return self.grid, self.STATUS_VALID_MOVE, self.done
+
+    def random_step(self):
+        """Choose a random valid move to play."""
+        return self.step(self.rng.choice(self.legal_moves()))
+
+    play_against_random = Environment.play_against_random
+    _play_against = Environment._play_against
+
+
+def make_environment(m=3, n=3, k=3, gravity=False):
+    """
+    Environment for an m,n,k game: the table-driven Environment for plain
+    3x3 Tic-Tac-Toe, an MNKEnvironment for anything else.
+    """
+    if (m, n, k, gravity) == (3, 3, 3, False):
+        return Environment()
+    return MNKEnvironment(m, n, k, gravity)
@@ -0,0 +1,117 @@
+"""
+Exact evaluation of a Policy against the uniform random agent.
+
+Only 5478 boards are reachable, so instead of sampling games as rate()
+does, the outcome distribution is computed by a memoized walk over the
+game tree: one batched forward pass gives the policy's move distribution
+at every reachable board where x is to move, and the expected outcome of
+each board is filled in layer by layer from the full boards back to the
+empty one.
+
+Invalid moves leave the board unchanged, so at a board where the policy
+puts mass q on occupied cells the agent retries a geometric number of
+times: the valid moves are taken with probability p_a / (1 - q) and the
+expected number of invalid moves there is q / (1 - q).
+
+`python exact.py <hidden-units-size> <ep>` to print the exact rates
+"""
+from __future__ import print_function
+import numpy as np
+import torch
+
+import states
+
+# columns of an outcome vector
+WIN, LOSE, TIE, INVALID = range(4)
+OUTCOMES = ('win', 'lose', 'tie', 'invalid')
+
+# boards where the policy is asked for a move
+AGENT_STATES = states.REACHABLE[(states.TURN[states.REACHABLE] == 1) &
+                                ~states.TERMINAL[states.REACHABLE]]
+_LAYERS = [states.REACHABLE[states.COUNT[states.REACHABLE] == n]
+           for n in range(10)]
+
+
+def action_probs(policy, state_ids):
+    """(N, 9) numpy move distribution of the policy at N state ids."""
+    state = torch.from_numpy(states.ONE_HOT[state_ids])
+    with torch.no_grad():
+        return policy(state).numpy().astype(np.float64)
+
+
+def outcome_values(probs):
+    """
+    Expected outcome of every reachable board under the given move
+    distributions.
+      @param probs: (..., NUM_STATES, 9) array; only the rows of
+                    AGENT_STATES are read
+      @returns (..., NUM_STATES, 4) array of win/lose/tie probabilities
+          and expected invalid moves from each board to the end of the
+          game (unreachable rows are left at zero)
+    """
+    lead = probs.shape[:-2]
+    V = np.zeros(lead + (states.NUM_STATES, 4))
+    for n in reversed(range(10)):
+        layer = _LAYERS[n]
+        done = layer[states.TERMINAL[layer]]
+        V[..., done[states.WINNER[done] == 1], WIN] = 1
+        V[..., done[states.WINNER[done] == 2], LOSE] = 1
+        V[..., done[states.TIE[done]], TIE] = 1
+        live = layer[~states.TERMINAL[layer]]
+        legal = states.LEGAL[live]
+        children = V[..., states.NEXT[live], :]
+        if n % 2:
+            # random agent: uniform over the empty cells
+            weights = legal / legal.sum(1, keepdims=True).astype(np.float64)
+            V[..., live, :] = (children * weights[..., None]).sum(-2)
+        else:
+            p = probs[..., live, :] * legal
+            valid = p.sum(-1, keepdims=True)
+            V[..., live, :] = (children * (p / valid)[..., None]).sum(-2)
+            V[..., live, INVALID] += 1 / valid[..., 0] - 1
+    return V
+
+
+def visit_probabilities(probs):
+    """
+    Probability that a game under the given move distributions (as for
+    outcome_values) passes through each board; (..., NUM_STATES) array.
+    """
+    lead = probs.shape[:-2]
+    D = np.zeros(lead + (states.NUM_STATES,))
+    D[..., states.EMPTY_STATE] = 1
+    for n in range(9):
+        live = _LAYERS[n][~states.TERMINAL[_LAYERS[n]]]
+        legal = states.LEGAL[live]
+        if n % 2:
+            weights = legal / legal.sum(1, keepdims=True).astype(np.float64)
+        else:
+            p = probs[..., live, :] * legal
+            weights = p / p.sum(-1, keepdims=True)
+        flow = D[..., live, None] * weights
+        children = states.NEXT[live][legal]
+        # children are all in layer n + 1, so D can be updated in place
+        np.add.at(D.reshape(-1, states.NUM_STATES).T, children,
+                  flow[..., legal].reshape(-1, children.size).T)
+    return D
+
+
+def exact_rate(policy):
+    """
+    Exact outcome distribution of a game of the policy against the random
+    agent, as a dict with the win/lose/tie probabilities and the expected
+    number of invalid moves per game.
+    """
+    probs = np.zeros((states.NUM_STATES, 9))
+    probs[AGENT_STATES] = action_probs(policy, AGENT_STATES)
+    value = outcome_values(probs)[states.EMPTY_STATE]
+    return dict(zip(OUTCOMES, value.tolist()))
+
+
+if __name__ == '__main__':
+    import sys
+    import tictactoe
+
+    policy = tictactoe.Policy(hidden_size=int(sys.argv[1]))
+    tictactoe.load_weights(policy, int(sys.argv[2]))
+    print(exact_rate(policy))
@@ -0,0 +1,230 @@
+"""
+Torch-free inference for saved Policy checkpoints.
+
+A checkpoint, from the checkpoint store or an old torch.save pickle, is
+loaded into numpy arrays and the 27 -> H -> 9 forward pass and move
+sampling are done in numpy, so querying a trained policy only pays for
+importing numpy. torch pickles are read with a restricted unpickler that
+maps the tensors torch.save writes (legacy or zip format) onto arrays;
+nothing else is allowed to be loaded from them.
+
+`python inference.py <hidden-units-size> <ep>` to print the first move
+distribution and rates, as `python tictactoe.py -l` does
+"""
+from __future__ import print_function
+from collections import OrderedDict
+import io
+import os
+import pickle
+import struct
+import zipfile
+import numpy as np
+
+import checkpoints
+import states
+from environment import Environment, VecEnvironment
+
+_DTYPES = {'DoubleStorage': np.float64, 'FloatStorage': np.float32,
+           'HalfStorage': np.float16, 'LongStorage': np.int64,
+           'IntStorage': np.int32, 'ShortStorage': np.int16,
+           'CharStorage': np.int8, 'ByteStorage': np.uint8,
+           'BoolStorage': np.bool_}
+
+
+class _Tensor(object):
+    """A tensor of a pickle, made into an array once its storage is read."""
+
+    def __init__(self, storage, offset, size, stride, *args):
+        self.storage = storage
+        self.offset = offset
+        self.size = tuple(size)
+        self.stride = tuple(stride)
+
+    def array(self, storages):
+        data = storages[self.storage[0]]
+        itemsize = data.dtype.itemsize
+        return np.lib.stride_tricks.as_strided(
+            data[self.offset:], self.size,
+            [s * itemsize for s in self.stride]).copy()
+
+
+class _TorchUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module == 'collections' and name == 'OrderedDict':
+            return OrderedDict
+        if module == 'torch._utils' and name in ('_rebuild_tensor',
+                                                 '_rebuild_tensor_v2'):
+            return _Tensor
+        if module == 'torch' and name in _DTYPES:
+            return _DTYPES[name]
+        raise pickle.UnpicklingError("cannot load %s.%s" % (module, name))
+
+    def persistent_load(self, saved_id):
+        # ('storage', dtype, key, location, numel[, view metadata])
+        _, dtype, key = saved_id[:3]
+        self.storage_types[key] = dtype
+        return key, dtype
+
+    def load(self):
+        self.storage_types = {}
+        return pickle.Unpickler.load(self)
+
+
+def _unpickle(data):
+    unpickler = _TorchUnpickler(io.BytesIO(data))
+    return unpickler.load(), unpickler.storage_types
+
+
+def load_pickle(path):
+    """
+    Load a state_dict saved with torch.save without torch; returns an
+    OrderedDict of numpy arrays.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as z:
+            names = z.namelist()
+            root = names[0].split('/')[0]
+            obj, types = _unpickle(z.read(root + '/data.pkl'))
+            storages = dict((key, np.frombuffer(
+                z.read('%s/data/%s' % (root, key)), dtype=dtype))
+                for key, dtype in types.items())
+    else:
+        with open(path, 'rb') as f:
+            for _ in range(3):  # magic number, protocol version, sys info
+                pickle.load(f)
+            unpickler = _TorchUnpickler(f)
+            obj = unpickler.load()
+            types = unpickler.storage_types
+            storages = {}
+            for key in pickle.load(f):
+                numel, = struct.unpack('<q', f.read(8))
+                dtype = np.dtype(types[key])
+                storages[key] = np.frombuffer(f.read(numel * dtype.itemsize),
+                                              dtype=dtype)
+    return OrderedDict((name, t.array(storages)) for name, t in obj.items())
+
+
+def sample_moves(probs, rng=None):
+    """
+    One move per row of (N, A) move distributions, by inverse-CDF
+    sampling with the numpy RandomState rng, the global one by default.
+    >>> sample_moves(np.eye(9)[[4, 0, 8]]).tolist()
+    [4, 0, 8]
+    """
+    if rng is None:
+        rng = np.random
+    return inverse_cdf(probs, rng.random_sample(len(probs)))
+
+
+def inverse_cdf(probs, u):
+    """
+    The moves sample_moves picks for (N,) uniforms u in [0, 1). u is
+    scaled by each row's total, so a row that sums to a little under 1,
+    as float32 tables do, never yields a move past its last nonzero
+    probability.
+    >>> probs = np.array([[0.5, 0.5 - 1e-7, 0.0]], dtype=np.float32)
+    >>> inverse_cdf(probs, np.array([1 - 1e-9])).tolist()
+    [1]
+    """
+    cdf = probs.cumsum(1)
+    return (cdf <= cdf[:, -1:] * u[:, None]).sum(1)
+
+
+class NumpyPolicy(object):
+    """
+    Policy.forward in numpy, on the weights of a Policy state_dict.
+    mask_illegal is as for Policy.
+    """
+
+    def __init__(self, params, mask_illegal=False):
+        params = dict(params)
+        self.w1 = np.asarray(params['affine1.weight'], dtype=np.float64)
+        self.b1 = np.asarray(params['affine1.bias'], dtype=np.float64)
+        self.w2 = np.asarray(params['affine2.weight'], dtype=np.float64)
+        self.b2 = np.asarray(params['affine2.bias'], dtype=np.float64)
+        self.hidden_size = self.w1.shape[0]
+        self.mask_illegal = mask_illegal
+
+    def __call__(self, x):
+        """(N, 9) move distributions for (N, 27) one-hot inputs."""
+        h = np.maximum(np.dot(x, self.w1.T) + self.b1, 0)
+        scores = np.dot(h, self.w2.T) + self.b2
+        if self.mask_illegal:
+            scores = np.where(np.asarray(x)[:, :9] > 0, scores, -np.inf)
+        scores -= scores.max(-1, keepdims=True)
+        e = np.exp(scores)
+        return e / e.sum(-1, keepdims=True)
+
+    def probs(self, state_ids):
+        """(N, 9) move distributions at N state ids."""
+        return self(states.ONE_HOT[state_ids])
+
+    def select_actions(self, grids):
+        """Sample one move per (N, 9) grid; returns an int64 array."""
+        return sample_moves(
+            self.probs(states.encode(np.asarray(grids).reshape(-1, 9))))
+
+
+def load_policy(hidden_size, episode, store=checkpoints.DEFAULT_PATH):
+    """
+    NumpyPolicy of a saved checkpoint, from the checkpoint store, with
+    the mask_illegal flag it was trained with, or an old pickle, as
+    tictactoe.load_weights finds it.
+    """
+    if os.path.exists(store):
+        store = checkpoints.open_store(store)
+        if (hidden_size, episode) in store:
+            return NumpyPolicy(store.arrays(hidden_size, episode),
+                               store.mask_illegal(hidden_size, episode))
+    return NumpyPolicy(load_pickle("testing/policy-%d.pkl" % episode))
+
+
+def first_move_distr(policy):
+    """The distribution of first moves."""
+    return policy.probs([states.EMPTY_STATE])
+
+
+def play_games(policy, num_games):
+    """tictactoe.play_games for a NumpyPolicy."""
+    venv = VecEnvironment(num_games, autoreset=False)
+    final = np.empty(num_games, dtype=np.int8)
+    invalid = np.zeros(num_games, dtype=np.int64)
+    live = np.arange(num_games)
+    while len(live):
+        codes = venv.play_rows_against_random(
+            live, policy.select_actions(venv.grid[live]))
+        invalid[live] += codes == venv.CODE_INVALID_MOVE
+        finished = venv.done[live]
+        final[live[finished]] = codes[finished]
+        live = live[~finished]
+    return venv.STATUSES[final], invalid
+
+
+def rate(policy, games=100):
+    """Win, lose, tie and invalid move counts over games against random."""
+    final, invalid = play_games(policy, games)
+    return (int((final == Environment.STATUS_WIN).sum()),
+            int((final == Environment.STATUS_LOSE).sum()),
+            int((final == Environment.STATUS_TIE).sum()),
+            int(invalid.sum()))
+
+
+def baby_play(env, policy):
+    """Play the policy's move on env and show the board."""
+    env.step(int(policy.select_actions(env.grid)[0]))
+    env.render()
+
+
+def main(argv):
+    np.random.seed(42)
+    policy = load_policy(int(argv[0]), int(argv[1]))
+    distr = first_move_distr(policy)
+    print(distr)
+    print(np.argmax(distr))
+    print("Rates:", rate(policy))
+
+
+if __name__ == '__main__':
+    import sys
+
+    main(sys.argv[1:])
@@ -0,0 +1,127 @@
+"""
+Compile a trained Policy into a per-state lookup table.
+
+A Policy is a fixed function of the board, and only 4520 non-terminal
+boards are reachable, so after training its move distribution can be
+computed once for all of them and stored. A PolicyTable holds an int16
+row index over all NUM_STATES state ids, the float32 move distribution
+of every compiled board and its argmax move; probs, select_actions and
+greedy are then array lookups, with no forward pass.
+
+With canonical=True only the 627 non-terminal canonical boards (see
+states.canonicalize) are compiled and every other board reads the row of
+its canonical image, with the cells permuted back. That matches
+Policy.forward only for a policy that is itself symmetric, e.g. one
+trained with symmetry=True; the default table matches it everywhere, up
+to the float32 rounding of a batched forward pass.
+
+PolicyTable has the probs/select_actions interface of
+inference.NumpyPolicy, so inference.rate, inference.play_games and
+server.py take either.
+
+`python lookup.py <hidden-units-size> <ep> [<out.npz>]` to compile a
+checkpoint
+"""
+from __future__ import print_function
+import numpy as np
+
+import inference
+import states
+
+LIVE_STATES = states.REACHABLE[~states.TERMINAL[states.REACHABLE]]
+CANONICAL_LIVE_STATES = states.CANONICAL_REACHABLE[
+    ~states.TERMINAL[states.CANONICAL_REACHABLE]]
+
+
+class PolicyTable(object):
+    """
+    Move distributions of a policy, looked up by state id.
+      @param state_ids: the compiled state ids, one per row of probs
+      @param probs: (R, 9) float32 move distributions
+      @param canonical: whether state_ids are canonical boards that stand
+                        for all of their symmetric images
+    """
+
+    def __init__(self, state_ids, probs, canonical=False):
+        self.state_ids = np.asarray(state_ids, dtype=np.int64)
+        self.table = np.asarray(probs, dtype=np.float32)
+        self.moves = self.table.argmax(1).astype(np.int8)
+        self.canonical = bool(canonical)
+        self.index = np.full(states.NUM_STATES, -1, dtype=np.int16)
+        self.index[self.state_ids] = np.arange(len(self.state_ids))
+
+    def covers(self, state_ids):
+        """Whether each state id has a row, or its canonical image has."""
+        state_ids = np.asarray(state_ids)
+        if self.canonical:
+            state_ids, _ = states.canonicalize(state_ids)
+        return self.index[state_ids] >= 0
+
+    def _rows(self, state_ids):
+        state_ids = np.asarray(state_ids)
+        sym = None
+        if self.canonical:
+            state_ids, sym = states.canonicalize(state_ids)
+        rows = self.index[state_ids]
+        if (rows < 0).any():
+            raise KeyError("state not in the table")
+        return rows, sym
+
+    def probs(self, state_ids):
+        """(N, 9) move distributions at N state ids."""
+        rows, sym = self._rows(state_ids)
+        if sym is None:
+            return self.table[rows]
+        return self.table[rows[..., None], states.INVERSE[sym]]
+
+    def greedy(self, state_ids):
+        """Most likely move at each state id."""
+        rows, sym = self._rows(state_ids)
+        if sym is None:
+            return self.moves[rows].astype(np.int64)
+        return states.SYMMETRIES[sym, self.moves[rows]]
+
+    def select_actions(self, grids):
+        """Sample one move per (N, 9) grid; returns an int64 array."""
+        return inference.sample_moves(
+            self.probs(states.encode(np.asarray(grids).reshape(-1, 9))))
+
+    def save(self, path):
+        """Write the table to an .npz file."""
+        np.savez(path, state_ids=self.state_ids, probs=self.table,
+                 canonical=self.canonical)
+
+
+def load_table(path):
+    """PolicyTable saved by PolicyTable.save."""
+    with np.load(path) as f:
+        return PolicyTable(f['state_ids'], f['probs'], bool(f['canonical']))
+
+
+def compile_policy(policy, canonical=False):
+    """
+    PolicyTable of a Policy (or inference.NumpyPolicy), from one batched
+    forward pass over every live reachable board, or canonical board.
+    """
+    state_ids = CANONICAL_LIVE_STATES if canonical else LIVE_STATES
+    if hasattr(policy, 'probs'):
+        probs = policy.probs(state_ids)
+    else:
+        import torch
+        with torch.no_grad():
+            probs = policy(torch.from_numpy(states.ONE_HOT[state_ids]))
+        probs = probs.numpy()
+    return PolicyTable(state_ids, probs, canonical)
+
+
+if __name__ == '__main__':
+    import sys
+    import tictactoe
+
+    policy = tictactoe.Policy(hidden_size=int(sys.argv[1]))
+    tictactoe.load_weights(policy, int(sys.argv[2]))
+    table = compile_policy(policy)
+    out = (sys.argv[3] if len(sys.argv) > 3 else
+           "policy-%s-%s.npz" % (sys.argv[1], sys.argv[2]))
+    table.save(out)
+    print("Compiled %d boards into %s" % (len(table.state_ids), out))
@@ -0,0 +1,173 @@
+"""
+Multi-process actor/learner training.
+
+Worker processes play episodes with a shared-memory copy of the Policy,
+against Environment.play_against_random or bonus.self_play, and send the
+states, actions and rewards back through a queue. The learner recomputes
+the log-probs of each batch, gathered in a TrajectoryBuffer, with its own
+Policy, applies the finish_episode update in a single backward pass and
+copies the new weights into the shared copy every sync_interval updates.
+
+`python parallel.py <random|self> <hidden-units-size> [workers]` to train
+"""
+from __future__ import print_function
+import copy
+import os
+import random
+from queue import Empty, Full
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+import checkpoints
+import tictactoe
+from tictactoe import (Environment, TrajectoryBuffer, action_log_probs,
+                       select_action)
+
+
+def _actor(rank, shared_policy, opponent, episode_queue, stop, seed):
+    """Worker loop: play episodes with shared_policy until stop is set."""
+    torch.set_num_threads(1)
+    random.seed(seed + rank)
+    np.random.seed(seed + rank)
+    torch.manual_seed(seed + rank)
+    env = Environment()
+    if opponent == 'self':
+        import bonus
+        get_reward = bonus.get_reward
+
+        def play(action):
+            return bonus.self_play(env, shared_policy, action)
+    else:
+        get_reward = tictactoe.get_reward
+        play = env.play_against_random
+
+    while not stop.is_set():
+        saved_states, saved_actions, saved_rewards = [], [], []
+        state = env.reset()
+        done = False
+        with torch.no_grad():
+            while not done:
+                action, _ = select_action(shared_policy, state)
+                saved_states.append(state.copy())
+                saved_actions.append(action)
+                state, status, done = play(action)
+                saved_rewards.append(get_reward(status))
+        episode = (np.array(saved_states), np.array(saved_actions),
+                   np.array(saved_rewards, dtype=np.float64))
+        while not stop.is_set():
+            try:
+                episode_queue.put(episode, timeout=0.1)
+                break
+            except Full:
+                continue
+
+
+def _next_episode(episode_queue, workers, timeout=1.0):
+    """
+    Next episode from the workers, raising RuntimeError instead of
+    waiting forever once a worker has died.
+    """
+    while True:
+        try:
+            return episode_queue.get(timeout=timeout)
+        except Empty:
+            dead = [w for w in workers if not w.is_alive()]
+            if dead:
+                raise RuntimeError(
+                    "%d actor process(es) died, exit codes %s" %
+                    (len(dead), [w.exitcode for w in dead]))
+
+
+def train_parallel(policy, opponent='random', num_workers=None,
+                   batch_size=32, num_episodes=60000, gamma=0.75,
+                   sync_interval=1, log_interval=1000, checkpoint_dir=None,
+                   seed=42):
+    """
+    Train policy with num_workers actor processes and this process as the
+    learner. opponent is 'random' (tictactoe.train) or 'self'
+    (bonus.self_train); checkpoints go to the checkpoints.bin store in
+    testing/ or stt/ respectively unless checkpoint_dir is given.
+    """
+    if num_workers is None:
+        num_workers = max(1, (os.cpu_count() or 2) - 1)
+    if checkpoint_dir is None:
+        checkpoint_dir = 'stt' if opponent == 'self' else 'testing'
+    store = checkpoints.open_store(os.path.join(checkpoint_dir,
+                                                "checkpoints.bin"))
+    shared_policy = copy.deepcopy(policy)
+    shared_policy.share_memory()
+
+    ctx = mp.get_context('spawn')
+    episode_queue = ctx.Queue(maxsize=4 * batch_size)
+    stop = ctx.Event()
+    workers = [ctx.Process(target=_actor,
+                           args=(rank, shared_policy, opponent,
+                                 episode_queue, stop, seed))
+               for rank in range(num_workers)]
+    for w in workers:
+        w.daemon = True
+        w.start()
+
+    optimizer, scheduler = tictactoe._make_optimizer(policy, batch_size)
+    buffer = TrajectoryBuffer()
+    running_reward = 0
+    running_episodes = 0
+    i_episode = 0
+    i_batch = 0
+    try:
+        while i_episode < num_episodes:
+            buffer.clear()
+            for _ in range(batch_size):
+                buffer.add_episode(*_next_episode(episode_queue, workers))
+            n = buffer.size
+            running_reward += buffer.rewards[:n].sum()
+            running_episodes += batch_size
+            # finish_episode for the whole batch, in one backward pass
+            returns = torch.from_numpy(buffer.normalized_returns(gamma))
+            log_probs = action_log_probs(policy, buffer.states[:n],
+                                         buffer.actions[:n])
+            (-(log_probs * returns.float()).sum()).backward()
+            optimizer.step()
+            scheduler.step()
+            optimizer.zero_grad()
+            i_batch += 1
+            if i_batch % sync_interval == 0:
+                with torch.no_grad():
+                    for dst, src in zip(shared_policy.parameters(),
+                                        policy.parameters()):
+                        dst.copy_(src)
+
+            i_episode += batch_size
+            log_episode = tictactoe.crossed_interval(i_episode, batch_size,
+                                                     log_interval)
+            if log_episode is not None:
+                tictactoe.log_progress(policy, log_episode,
+                                       running_reward / running_episodes,
+                                       store)
+                running_reward = 0
+                running_episodes = 0
+    finally:
+        stop.set()
+        for w in workers:
+            w.join(timeout=5)
+            if w.is_alive():
+                w.terminate()
+    return policy
+
+
+if __name__ == '__main__':
+    import sys
+
+    opponent = sys.argv[1]
+    hidden = int(sys.argv[2])
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    if opponent == 'self':
+        import bonus
+        policy = bonus.Policy(hidden_size=hidden)
+        bonus.load_weights(policy, 150000)
+        train_parallel(policy, 'self', num_workers=workers, gamma=1.0,
+                       log_interval=5000)
+    else:
+        policy = tictactoe.Policy(hidden_size=hidden)
+        train_parallel(policy, 'random', num_workers=workers)
@@ -0,0 +1,163 @@
+"""
+Per-phase timing and training metrics for train().
+
+A Profiler times named phases of the training loop (rollout, backward,
+optimizer, evaluate, checkpoint), counts episodes, steps and invalid
+moves, and at every log_interval appends one JSON record per line to a
+local file:
+
+    {"episode": 1000, "wall": 3.1, "episodes": 1000, "steps": 4210,
+     "mean_length": 4.21, "invalid": 37, "invalid_per_episode": 0.037,
+     "phases": {"rollout": 1.9, "backward": 0.7, ...}, ...}
+
+With no path the profiler is disabled: phase() hands back a shared no-op
+context manager and the counters return immediately, so the loop pays
+one method call per phase.
+
+`python profiling.py <records.jsonl>` to print where the time went
+"""
+from __future__ import print_function
+import json
+from timeit import default_timer
+
+PHASES = ('rollout', 'backward', 'optimizer', 'evaluate', 'checkpoint')
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+    def __init__(self, totals, name):
+        self.totals = totals
+        self.name = name
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, *exc):
+        self.totals[self.name] = (self.totals.get(self.name, 0.0) +
+                                  default_timer() - self.start)
+        return False
+
+
+class Profiler(object):
+    """
+    Phase timer and metric stream of one training run; disabled when path
+    is None.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.enabled = path is not None
+        self._file = open(path, 'a') if self.enabled else None
+        self._start = default_timer()
+        self._reset()
+
+    def _reset(self):
+        self.totals = {}
+        self.episodes = 0
+        self.steps = 0
+        self.invalid = 0
+
+    def phase(self, name):
+        """Context manager adding its wall time to the named phase."""
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self.totals, name)
+
+    def episodes_done(self, lengths, invalid):
+        """
+        Count finished episodes.
+          @param lengths: number of steps of each episode (sequence)
+          @param invalid: total number of invalid moves in them
+        """
+        if not self.enabled:
+            return
+        self.episodes += len(lengths)
+        self.steps += int(sum(lengths))
+        self.invalid += int(invalid)
+
+    def record(self, episode, **fields):
+        """
+        Write a record for everything since the last one, with any extra
+        fields (e.g. the average return or rate() results), and start
+        counting afresh.
+        """
+        self.write(self.take(episode, **fields))
+
+    def take(self, episode, **fields):
+        """
+        The record record() would write, without writing it, e.g. to add
+        results that are computed later; counting starts afresh. None when
+        the profiler is disabled.
+        """
+        if not self.enabled:
+            return None
+        rec = {'episode': episode,
+               'wall': default_timer() - self._start,
+               'episodes': self.episodes,
+               'steps': self.steps,
+               'mean_length': self.steps / float(max(self.episodes, 1)),
+               'invalid': self.invalid,
+               'invalid_per_episode':
+                   self.invalid / float(max(self.episodes, 1)),
+               'phases': dict((name, self.totals.get(name, 0.0))
+                              for name in PHASES)}
+        rec.update(fields)
+        self._reset()
+        return rec
+
+    def write(self, rec, **fields):
+        """Write a record from take(), with any further fields."""
+        if rec is None:
+            return
+        rec = dict(rec, **fields)
+        self._file.write(json.dumps(rec) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def load_records(path):
+    """List of the records in a file written by Profiler."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records):
+    """Total seconds spent in each phase over the given records."""
+    totals = dict((name, 0.0) for name in PHASES)
+    for rec in records:
+        for name, seconds in rec['phases'].items():
+            totals[name] = totals.get(name, 0.0) + seconds
+    return totals
+
+
+if __name__ == '__main__':
+    import sys
+
+    records = load_records(sys.argv[1])
+    totals = summarize(records)
+    overall = sum(totals.values())
+    for name in sorted(totals, key=totals.get, reverse=True):
+        print('{:<12} {:>10.3f}s {:>6.1f}%'.format(
+            name, totals[name], 100 * totals[name] / max(overall, 1e-12)))
+    episodes = sum(r['episodes'] for r in records)
+    print('{} episodes, {:.2f} steps and {:.4f} invalid moves per '
+          'episode'.format(episodes,
+                           sum(r['steps'] for r in records) /
+                           float(max(episodes, 1)),
+                           sum(r['invalid'] for r in records) /
+                           float(max(episodes, 1))))
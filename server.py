@@ -0,0 +1,270 @@
+"""
+Local move server for trained checkpoints.
+
+Checkpoints are loaded once, torch-free (see inference.py), and kept in
+memory. Move requests arriving together for the same checkpoint are
+grouped into micro-batches: the first request of a batch waits at most
+max_delay seconds for others to join, up to max_batch requests, and the
+whole batch is answered with a single forward pass.
+
+HTTP on localhost, with keep-alive:
+
+    POST /move   {"board": [0, 1, 0, 2, 0, 0, 0, 0, 0],
+                  "model": "128:60000", "greedy": false}
+             ->  {"move": 4, "probs": [...], "model": "128:60000"}
+    GET  /stats  p50/p99 latency in ms, throughput and mean batch size
+                 per model
+
+"model" defaults to the first checkpoint given on the command line. A
+table compiled by lookup.py can be served in place of a checkpoint by
+giving its .npz path; its moves are then lookups with no forward pass.
+
+`python server.py <hidden>:<ep>|<table.npz> [...] [--port 8000]`
+"""
+from __future__ import print_function
+import asyncio
+import collections
+import json
+import time
+import numpy as np
+
+import inference
+import lookup
+import states
+
+# states a move can be asked for: reachable in play and not yet over
+LIVE = np.zeros(states.NUM_STATES, dtype=bool)
+LIVE[lookup.LIVE_STATES] = True
+
+
+class LatencyStats(object):
+    """Latencies of the last window requests, and overall counts."""
+
+    def __init__(self, window=10000):
+        self.latencies = collections.deque(maxlen=window)
+        self.batch_sizes = collections.deque(maxlen=window)
+        self.requests = 0
+        self.batches = 0
+        self.start = time.time()
+
+    def add_batch(self, latencies):
+        self.latencies.extend(latencies)
+        self.batch_sizes.append(len(latencies))
+        self.requests += len(latencies)
+        self.batches += 1
+
+    def summary(self):
+        """
+        Request and batch counts, requests per second since the start,
+        mean batch size and the p50/p99 latency in ms of the window.
+        """
+        elapsed = time.time() - self.start
+        result = {'requests': self.requests, 'batches': self.batches,
+                  'throughput': self.requests / elapsed if elapsed else 0.0,
+                  'mean_batch': (float(np.mean(self.batch_sizes))
+                                 if self.batch_sizes else 0.0)}
+        if self.latencies:
+            p50, p99 = np.percentile(self.latencies, [50, 99])
+            result['p50_ms'] = 1e3 * p50
+            result['p99_ms'] = 1e3 * p99
+        return result
+
+
+class MicroBatcher(object):
+    """
+    Answers move requests for one policy, a micro-batch at a time.
+    """
+
+    def __init__(self, policy, max_batch=256, max_delay=0.002):
+        self.policy = policy
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.stats = LatencyStats()
+        self._queue = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def move(self, board, greedy=False):
+        """Move and move distribution of the policy on one board."""
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((time.time(), board, greedy, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(),
+                                                        timeout))
+                except asyncio.TimeoutError:
+                    break
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            self._answer(batch)
+
+    def _answer(self, batch):
+        try:
+            grids = np.array([board for _, board, _, _ in batch])
+            probs = self.policy.probs(states.encode(grids))
+            greedy = np.array([g for _, _, g, _ in batch])
+            moves = np.where(greedy, probs.argmax(1),
+                             inference.sample_moves(probs))
+        except Exception as e:
+            if len(batch) > 1:
+                # answer one by one, so only the bad requests fail
+                for request in batch:
+                    self._answer([request])
+                return
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        now = time.time()
+        self.stats.add_batch([now - start for start, _, _, _ in batch])
+        for i, (_, _, _, future) in enumerate(batch):
+            if not future.done():
+                future.set_result((int(moves[i]), probs[i].tolist()))
+
+
+class MoveServer(object):
+    """
+    HTTP front end over one MicroBatcher per checkpoint.
+      @param models: ordered (name, NumpyPolicy or PolicyTable) pairs;
+                     the first one is the default model
+    """
+
+    def __init__(self, models, max_batch=256, max_delay=0.002):
+        self.names = [name for name, _ in models]
+        self.batchers = dict((name, MicroBatcher(policy, max_batch,
+                                                 max_delay))
+                             for name, policy in models)
+
+    async def handle_move(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("request must be a JSON object")
+        name = request.get('model', self.names[0])
+        if name not in self.batchers:
+            raise KeyError("unknown model %r" % name)
+        board = [int(c) for c in request['board']]
+        if len(board) != 9 or not all(c in (0, 1, 2) for c in board):
+            raise ValueError("board must be 9 cells of 0, 1 or 2")
+        greedy = request.get('greedy', False)
+        if not isinstance(greedy, bool):
+            raise ValueError("greedy must be true or false")
+        # a finished or unreachable board has no move to answer with,
+        # and one a table lacks would fail the whole micro-batch
+        state = states.encode(np.array(board))
+        if not LIVE[state]:
+            raise ValueError("board is not a live position")
+        policy = self.batchers[name].policy
+        if hasattr(policy, 'covers') and not policy.covers(state):
+            raise ValueError("board not in the table of model %r" % name)
+        move, probs = await self.batchers[name].move(board, greedy)
+        return {'move': move, 'probs': probs, 'model': name}
+
+    def stats(self):
+        return dict((name, self.batchers[name].stats.summary())
+                    for name in self.names)
+
+    async def _respond(self, method, path, body):
+        if method == 'POST' and path == '/move':
+            try:
+                return 200, await self.handle_move(json.loads(body))
+            except (KeyError, ValueError, TypeError) as e:
+                return 400, {'error': str(e)}
+        if method == 'GET' and path == '/stats':
+            return 200, self.stats()
+        return 404, {'error': 'not found'}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, path, version = line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+                code, result = await self._respond(method, path, body)
+                payload = json.dumps(result).encode('utf-8')
+                close = (headers.get('connection', '').lower() == 'close' or
+                         version == 'HTTP/1.0')
+                writer.write(('HTTP/1.1 %d %s\r\n'
+                              'Content-Type: application/json\r\n'
+                              'Content-Length: %d\r\n'
+                              'Connection: %s\r\n\r\n' % (
+                                  code, {200: 'OK', 400: 'Bad Request',
+                                         404: 'Not Found'}[code],
+                                  len(payload),
+                                  'close' if close else 'keep-alive')
+                              ).encode('latin-1') + payload)
+                await writer.drain()
+                if close:
+                    break
+        except (ValueError, asyncio.IncompleteReadError,
+                ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        """Serve until cancelled."""
+        server = await asyncio.start_server(self.handle_connection, host,
+                                            port)
+        async with server:
+            await server.serve_forever()
+
+
+def load_models(specs):
+    """
+    (name, policy) pairs for '<hidden>:<episode>' specs, or paths of
+    tables saved by lookup.py.
+    """
+    models = []
+    for spec in specs:
+        if spec.endswith('.npz'):
+            models.append((spec, lookup.load_table(spec)))
+            continue
+        hidden, episode = spec.split(':')
+        models.append((spec, inference.load_policy(int(hidden),
+                                                   int(episode))))
+    return models
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('models', nargs='+',
+                        help='<hidden>:<episode> or <table.npz>')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-delay', type=float, default=0.002,
+                        help='seconds a request waits for a batch to fill')
+    args = parser.parse_args()
+
+    models = load_models(args.models)
+
+    async def main():
+        server = MoveServer(models, args.max_batch, args.max_delay)
+        print('Serving %s on http://%s:%d' % (', '.join(server.names),
+                                              args.host, args.port))
+        await server.serve(args.host, args.port)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
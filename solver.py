@@ -0,0 +1,107 @@
+"""
+Perfect-play solver for Tic-Tac-Toe.
+
+VALUES[s] is the negamax value of state s for the player to move: 1 if
+that player can force a win, 0 for a draw and -1 for a loss. The table is
+solved once over the reachable boards, layer by layer from the full
+boards back to the empty one, and cached on disk as a 19683-byte int8
+array so later runs just load it.
+
+`python solver.py <hidden-units-size> <ep> [<ep> ...]` to print how often
+each checkpoint picks a value-losing move
+"""
+from __future__ import print_function
+import os
+import numpy as np
+
+import states
+
+# next to this module, wherever it is run or imported from
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "solver-values.npy")
+_values = None
+
+
+def solve():
+    """Negamax value of every reachable board; int8 array of NUM_STATES."""
+    V = np.zeros(states.NUM_STATES, dtype=np.int8)
+    for n in reversed(range(10)):
+        layer = states.REACHABLE[states.COUNT[states.REACHABLE] == n]
+        # whoever just moved into a won board has won
+        done = layer[states.TERMINAL[layer]]
+        V[done] = np.where(states.WINNER[done] != 0, -1, 0)
+        live = layer[~states.TERMINAL[layer]]
+        scores = np.where(states.LEGAL[live], -V[states.NEXT[live]], -2)
+        V[live] = scores.max(1)
+    return V
+
+
+def load_values(path=CACHE_PATH):
+    """Load the value table from path, solving and caching it if needed."""
+    global _values
+    if _values is None:
+        if os.path.exists(path):
+            _values = np.load(path)
+        else:
+            _values = solve()
+            np.save(path, _values)
+    return _values
+
+
+def move_values(state_ids):
+    """
+    Value of each move for the player to move at the given state ids;
+    illegal moves get -2.
+    >>> move_values(states.encode([1, 1, 0, 2, 2, 0, 0, 0, 0])).tolist()
+    [-2, -2, 1, -2, -2, 0, -1, -1, -1]
+    """
+    values = load_values()
+    return np.where(states.LEGAL[state_ids], -values[states.NEXT[state_ids]],
+                    -2)
+
+
+def best_moves(state):
+    """
+    Python list of the optimal moves at state.
+    >>> best_moves(states.encode([1, 0, 0, 0, 2, 0, 0, 0, 0]))
+    [1, 2, 3, 5, 6, 7, 8]
+    """
+    scores = move_values(state)
+    return np.flatnonzero(scores == scores.max()).tolist()
+
+
+def blunder_rate(probs):
+    """
+    How often a policy with move distributions probs (as for
+    exact.outcome_values) picks a value-losing move, i.e. a legal move
+    worth less than the best one. Invalid moves are not counted.
+      @returns dict with 'per_position', the mean value-losing mass over
+          every board x can face, and 'per_game', the expected number of
+          value-losing moves in a game against the random agent
+    """
+    import exact
+    agent = exact.AGENT_STATES
+    scores = move_values(agent)
+    losing = (scores >= -1) & (scores < scores.max(1, keepdims=True))
+    p = probs[..., agent, :] * states.LEGAL[agent]
+    mass = (p * losing).sum(-1) / p.sum(-1)
+    visits = exact.visit_probabilities(probs)[..., agent]
+    return {'per_position': mass.mean(-1),
+            'per_game': (visits * mass).sum(-1)}
+
+
+if __name__ == '__main__':
+    import sys
+    import exact
+    import tictactoe
+
+    policy = tictactoe.Policy(hidden_size=int(sys.argv[1]))
+    for ep in sys.argv[2:]:
+        tictactoe.load_weights(policy, int(ep))
+        probs = np.zeros((states.NUM_STATES, 9))
+        probs[exact.AGENT_STATES] = exact.action_probs(policy,
+                                                       exact.AGENT_STATES)
+        rates = blunder_rate(probs)
+        print('Episode {}\tvalue-losing moves: {:.4f} per position, '
+              '{:.4f} per game'.format(ep, rates['per_position'],
+                                       rates['per_game']))
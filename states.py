@@ -0,0 +1,142 @@
+"""
+Precomputed lookup tables over all 3^9 Tic-Tac-Toe boards.
+
+A board is identified by its base-3 state id, sum(grid[i] * 3**i), with
+cells holding 0 (empty), 1 (x) or 2 (o). Every table below is indexed by
+that id, so a move, a win check or a tie check is a single array lookup.
+"""
+import numpy as np
+
+NUM_STATES = 3 ** 9
+EMPTY_STATE = 0
+POWERS = 3 ** np.arange(9)
+
+# possible ways to win
+WIN_LINES = np.array([(0, 1, 2), (3, 4, 5), (6, 7, 8),  # horizontal
+                      (0, 3, 6), (1, 4, 7), (2, 5, 8),  # vertical
+                      (0, 4, 8), (2, 4, 6)])  # diagonal
+
+# BOARDS[s] is the 9-cell grid of state s
+BOARDS = ((np.arange(NUM_STATES)[:, None] // POWERS) % 3).astype(np.int8)
+
+
+def _line_winner(player):
+    lines = BOARDS[:, WIN_LINES]
+    return (lines == player).all(2).any(1)
+
+
+# WINNER[s]: 0 if nobody has three in a row, else the winning player
+# (3 only for unreachable boards where both players have a line)
+WINNER = (_line_winner(1) * 1 + _line_winner(2) * 2).astype(np.int8)
+# TURN[s]: the player to move, x moving first
+TURN = np.where((BOARDS == 1).sum(1) > (BOARDS == 2).sum(1), 2, 1).astype(
+    np.int8)
+FULL = (BOARDS != 0).all(1)
+TIE = FULL & (WINNER == 0)
+TERMINAL = FULL | (WINNER != 0)
+# LEGAL[s, a]: cell a is empty and the game at s is not over
+LEGAL = (BOARDS == 0) & ~TERMINAL[:, None]
+# NEXT[s, a]: state after the player to move marks cell a (s if illegal)
+NEXT = np.where(LEGAL,
+                np.arange(NUM_STATES)[:, None] + TURN[:, None] * POWERS,
+                np.arange(NUM_STATES)[:, None]).astype(np.int32)
+
+
+# ONE_HOT[s]: the 27-dim Policy input of state s, with ONE_HOT[s, 9 * v + i]
+# set when cell i holds v
+ONE_HOT = np.zeros((NUM_STATES, 3, 9), dtype=np.float32)
+ONE_HOT[np.arange(NUM_STATES)[:, None], BOARDS, np.arange(9)] = 1
+ONE_HOT = ONE_HOT.reshape(NUM_STATES, 27)
+
+
+def encode(grid):
+    """
+    State id of a grid, or of each row of an (N, 9) array of grids.
+    >>> encode([0, 0, 0, 0, 0, 0, 0, 0, 0])
+    0
+    >>> encode([1, 2, 0, 0, 0, 0, 0, 0, 0])
+    7
+    """
+    ids = np.asarray(grid, dtype=np.int64).dot(POWERS)
+    return int(ids) if np.ndim(ids) == 0 else ids
+
+
+def decode(state):
+    """
+    Grid (or (N, 9) grids) of a state id (or an array of ids).
+    >>> decode(7).tolist()
+    [1, 2, 0, 0, 0, 0, 0, 0, 0]
+    """
+    return BOARDS[state].astype(np.int64)
+
+
+def legal_moves(state):
+    """
+    Python list of the legal cells at state.
+    >>> legal_moves(encode([1, 2, 1, 2, 1, 2, 0, 0, 0]))
+    [6, 7, 8]
+    >>> legal_moves(encode([1, 1, 1, 2, 2, 0, 0, 0, 0]))
+    []
+    """
+    return np.flatnonzero(LEGAL[state]).tolist()
+
+
+def _reachable():
+    frontier = np.array([EMPTY_STATE])
+    seen = [frontier]
+    while frontier.size:
+        live = frontier[~TERMINAL[frontier]]
+        frontier = np.unique(NEXT[live][LEGAL[live]])
+        seen.append(frontier)
+    return np.unique(np.concatenate(seen))
+
+
+# COUNT[s]: number of marks on the board
+COUNT = (BOARDS != 0).sum(1).astype(np.int8)
+# sorted ids of every board reachable from the empty board by legal play
+REACHABLE = _reachable()
+
+# the 8 symmetries of the board (4 rotations, 4 reflections) as cell
+# permutations: grid[SYMMETRIES[k]] is the k-th image of grid, and a mark
+# at cell a of grid sits at cell INVERSE[k, a] of that image
+_CELLS = np.arange(9).reshape(3, 3)
+SYMMETRIES = np.array([np.rot90(_CELLS, k).reshape(-1) for k in range(4)] +
+                      [np.rot90(_CELLS.T, k).reshape(-1) for k in range(4)])
+INVERSE = np.argsort(SYMMETRIES, axis=1)
+# SYM_STATES[s, k]: state id of the k-th image of s
+SYM_STATES = BOARDS[:, SYMMETRIES].astype(np.int64).dot(POWERS)
+# CANONICAL[s]: smallest id among the images of s, reached by symmetry
+# CANONICAL_SYM[s]
+CANONICAL = SYM_STATES.min(1)
+CANONICAL_SYM = SYM_STATES.argmin(1)
+# sorted ids of the canonical forms of the reachable boards
+CANONICAL_REACHABLE = np.unique(CANONICAL[REACHABLE])
+
+
+def canonicalize(state):
+    """
+    Canonical state id of state (or an array of ids) and the symmetry
+    that maps state onto it.
+    >>> c, k = canonicalize(encode([0, 0, 0, 0, 0, 0, 0, 0, 1]))
+    >>> decode(c).tolist(), int(to_canonical_action(8, k))
+    ([1, 0, 0, 0, 0, 0, 0, 0, 0], 0)
+    >>> bool(canonicalize(encode([0, 0, 1, 0, 0, 0, 0, 0, 0]))[0] == c)
+    True
+    """
+    return CANONICAL[state], CANONICAL_SYM[state]
+
+
+def to_canonical_action(action, sym):
+    """Cell of the canonical board that action on the original maps to."""
+    return INVERSE[sym, action]
+
+
+def from_canonical_action(action, sym):
+    """
+    Cell of the original board that action on its canonical form maps to.
+    >>> state = encode([0, 0, 0, 0, 0, 0, 0, 0, 1])
+    >>> c, k = canonicalize(state)
+    >>> int(from_canonical_action(to_canonical_action(5, k), k))
+    5
+    """
+    return SYMMETRIES[sym, action]
@@ -0,0 +1,79 @@
+"""
+Evaluate every checkpoint of a run in one pass.
+
+The weights of M checkpoints are taken from the checkpoint store as
+stacked (M, ...) arrays, the M policies are run together over every
+reachable board with batched matrix products, and the exact metrics of
+exact.py and solver.py are computed for all of them at once.
+
+`python sweep.py <hidden-units-size>` to print the metrics of every
+checkpoint in testing/checkpoints.bin
+"""
+from __future__ import print_function
+import numpy as np
+
+import checkpoints
+import exact
+import solver
+import states
+
+
+def stacked_probs(params, x, mask_illegal=False):
+    """
+    Policy.forward of M stacked checkpoints on the same (N, 27) input.
+      @param params: dict of affine1/affine2 weights and biases with a
+                     leading axis of M, as from CheckpointStore.stack
+      @param mask_illegal: Policy.mask_illegal, for all checkpoints or as
+                           a sequence of M flags
+      @returns (M, N, 9) array of move distributions
+    """
+    h = np.matmul(x, params['affine1.weight'].transpose(0, 2, 1))
+    h = np.maximum(h + params['affine1.bias'][:, None, :], 0)
+    scores = np.matmul(h, params['affine2.weight'].transpose(0, 2, 1))
+    scores += params['affine2.bias'][:, None, :]
+    masked = np.asarray(mask_illegal, dtype=bool).reshape(-1, 1, 1)
+    scores = np.where(masked & (np.asarray(x)[:, :9] == 0), -np.inf, scores)
+    scores -= scores.max(-1, keepdims=True)
+    e = np.exp(scores)
+    return e / e.sum(-1, keepdims=True)
+
+
+def sweep_checkpoints(store, hidden_size, episodes=None):
+    """
+    Metrics of many checkpoints of one hidden size, as a dict of arrays
+    with one row per checkpoint: 'episodes', 'first_move' (M, 9),
+    exact 'win', 'lose', 'tie' and 'invalid' rates against the random
+    agent, and the 'blunder_per_position' / 'blunder_per_game' rates of
+    solver.blunder_rate.
+    """
+    if episodes is None:
+        episodes = store.episodes(hidden_size)
+    params = dict(store.stack(hidden_size, episodes))
+    agent = exact.AGENT_STATES
+    probs = np.zeros((len(episodes), states.NUM_STATES, 9))
+    probs[:, agent] = stacked_probs(
+        params, states.ONE_HOT[agent],
+        [store.mask_illegal(hidden_size, ep) for ep in episodes])
+    values = exact.outcome_values(probs)[:, states.EMPTY_STATE]
+    blunders = solver.blunder_rate(probs)
+    result = {'episodes': np.array(episodes),
+              'first_move': probs[:, states.EMPTY_STATE],
+              'blunder_per_position': blunders['per_position'],
+              'blunder_per_game': blunders['per_game']}
+    for i, name in enumerate(exact.OUTCOMES):
+        result[name] = values[:, i]
+    return result
+
+
+if __name__ == '__main__':
+    import sys
+    import tictactoe
+
+    store = checkpoints.open_store(tictactoe.CHECKPOINT_STORE)
+    result = sweep_checkpoints(store, int(sys.argv[1]))
+    for i, ep in enumerate(result['episodes']):
+        print('Episode {}\tfirst move: {}\twin: {:.4f}\tlose: {:.4f}\t'
+              'tie: {:.4f}\tinvalid: {:.4f}\tblunders: {:.4f}'.format(
+                  ep, np.argmax(result['first_move'][i]), result['win'][i],
+                  result['lose'][i], result['tie'][i], result['invalid'][i],
+                  result['blunder_per_game'][i]))
@@ -1,16 +1,33 @@
 from __future__ import print_function
+import sys
+
+if __name__ == '__main__' and len(sys.argv) == 4 and sys.argv[1] == '-l':
+    # the query only needs numpy, so answer it before torch is imported
+    import inference
+    inference.main(sys.argv[2:])
+    sys.exit()
+
 from collections import defaultdict
 from itertools import count
+import copy
 import numpy as np
 import math
+import os
+import queue
 import random
+import threading
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 import torch.distributions
 from torch.autograd import Variable
-import matplotlib.pyplot as plt
+import checkpoints
+import inference
+import profiling
+import states
+from environment import (Environment, MNKEnvironment, VecEnvironment,
+                         make_environment)
 
 np.random.seed(42)
 random.seed(42)
@@ -22,121 +39,145 @@ loses = []
 ties = []
 invalids = []
 first_moves = [[0], [0], [0], [0], [0], [0], [0], [0], [0]]
-
-
-class Environment(object):
-    """
-    The Tic-Tac-Toe Environment
-    """
-    # possible ways to win
-    win_set = frozenset([(0, 1, 2), (3, 4, 5), (6, 7, 8),  # horizontal
-                         (0, 3, 6), (1, 4, 7), (2, 5, 8),  # vertical
-                         (0, 4, 8), (2, 4, 6)])  # diagonal
-    # statuses
-    STATUS_VALID_MOVE = 'valid'
-    STATUS_INVALID_MOVE = 'inv'
-    STATUS_WIN = 'win'
-    STATUS_TIE = 'tie'
-    STATUS_LOSE = 'lose'
-    STATUS_DONE = 'done'
-
-    def __init__(self):
-        self.reset()
-
-    def reset(self):
-        """Reset the game to an empty board."""
-        self.grid = np.array([0] * 9)  # grid
-        self.turn = 1  # whose turn it is
-        self.done = False  # whether game is done
-        return self.grid
-
-    def render(self):
-        """Print what is on the board."""
-        map = {0: '.', 1: 'x', 2: 'o'}  # grid label vs how to plot
-        print(''.join(map[i] for i in self.grid[0:3]))
-        print(''.join(map[i] for i in self.grid[3:6]))
-        print(''.join(map[i] for i in self.grid[6:9]))
-        print('====')
-
-    def check_win(self):
-        """Check if someone has won the game."""
-        for pos in self.win_set:
-            s = set([self.grid[p] for p in pos])
-            if len(s) == 1 and (0 not in s):
-                return True
-        return False
-
-    def step(self, action):
-        """Mark a point on position action."""
-        assert type(action) == int and action >= 0 and action < 9
-        # done = already finished the game
-        if self.done:
-            return self.grid, self.STATUS_DONE, self.done
-        # action already have something on it
-        if self.grid[action] != 0:
-            return self.grid, self.STATUS_INVALID_MOVE, self.done
-        # play move
-        self.grid[action] = self.turn
-        if self.turn == 1:
-            self.turn = 2
-        else:
-            self.turn = 1
-        # check win
-        if self.check_win():
-            self.done = True
-            return self.grid, self.STATUS_WIN, self.done
-        # check tie
-        if all([p != 0 for p in self.grid]):
-            self.done = True
-            return self.grid, self.STATUS_TIE, self.done
-        return self.grid, self.STATUS_VALID_MOVE, self.done
-
-    def random_step(self):
-        """Choose a random, unoccupied move on the board to play."""
-        pos = [i for i in range(9) if self.grid[i] == 0]
-        move = random.choice(pos)
-        return self.step(move)
-
-    def play_against_random(self, action):
-        """Play a move, and then have a random agent play the next move."""
-        state, status, done = self.step(action)
-        if not done and self.turn == 2:
-            state, s2, done = self.random_step()
-            if done:
-                if s2 == self.STATUS_WIN:
-                    status = self.STATUS_LOSE
-                elif s2 == self.STATUS_TIE:
-                    status = self.STATUS_TIE
-                else:
-                    raise ValueError("???")
-        return state, status, done
+CHECKPOINT_STORE = checkpoints.DEFAULT_PATH
 
 
 class Policy(nn.Module):
     """
     The Tic-Tac-Toe Policy
+
+    With mask_illegal, occupied cells get no probability: the softmax is
+    taken over the empty cells only, read off the board input itself, so
+    every sampled move is valid and an episode is at most 5 agent moves.
+    The flag is not part of the state_dict; the checkpoint store keeps it
+    next to each checkpoint and load_weights restores it.
+
+    Policy.for_environment sizes the layers for any m,n,k environment.
     """
 
-    def __init__(self, input_size=27, hidden_size=256, output_size=9):
+    def __init__(self, input_size=27, hidden_size=256, output_size=9,
+                 mask_illegal=False):
         super(Policy, self).__init__()
         self.affine1 = nn.Linear(input_size, hidden_size)
         self.affine2 = nn.Linear(hidden_size, output_size)
+        self.mask_illegal = mask_illegal
+
+    @classmethod
+    def for_environment(cls, env, hidden_size=256, **kwargs):
+        """Policy with 3 one-hot inputs per cell, one output per action."""
+        return cls(input_size=3 * env.num_cells, hidden_size=hidden_size,
+                   output_size=env.num_actions, **kwargs)
 
     def forward(self, x):
-        x = F.relu(self.affine1(x))
-        action_scores = self.affine2(x)
+        return self._probs(x, F.relu(self.affine1(x)))
+
+    def _probs(self, x, h):
+        action_scores = self.affine2(h)
+        if self.mask_illegal:
+            # the first inputs flag the empty cells (see states.ONE_HOT);
+            # an action is legal when its cell, or the top cell of its
+            # column under gravity, is empty
+            legal = x[:, :action_scores.size(1)]
+            action_scores = action_scores.masked_fill(legal == 0,
+                                                      float('-inf'))
         return F.softmax(action_scores, dim=1)
 
 
-def select_action(policy, state):
-    """Samples an action from the policy at the state."""
-    state = torch.from_numpy(state).long().unsqueeze(0)
-    state = torch.zeros(3, 9).scatter_(0, state, 1).view(1, 27)
+class ActorCritic(Policy):
+    """
+    Policy with a state-value head on the shared affine1 layer. forward is
+    Policy.forward, so it plays wherever a Policy does; its checkpoints
+    also hold value_head.
+    """
+
+    def __init__(self, input_size=27, hidden_size=256, output_size=9,
+                 mask_illegal=False):
+        super(ActorCritic, self).__init__(input_size, hidden_size,
+                                          output_size, mask_illegal)
+        self.value_head = nn.Linear(hidden_size, 1)
+
+    def policy_and_value(self, x):
+        """Move distributions and (N,) state values, sharing affine1."""
+        h = F.relu(self.affine1(x))
+        return self._probs(x, h), self.value_head(h).squeeze(1)
+
+
+# Policy inputs of every state id, shared with states.ONE_HOT
+ENCODING = torch.from_numpy(states.ONE_HOT)
+
+
+def encode_inputs(state_ids, out=None):
+    """
+    (N, 27) Policy input of N state ids, gathered from ENCODING. When out
+    is given, the rows are written into its first N rows instead of a new
+    tensor, so a loop can reuse one buffer.
+    """
+    ids = torch.from_numpy(np.asarray(state_ids, dtype=np.int64).reshape(-1))
+    if out is None:
+        return ENCODING.index_select(0, ids)
+    return torch.index_select(ENCODING, 0, ids, out=out[:ids.size(0)])
+
+
+def encode_grids(grids, out=None):
+    """
+    (N, 3 * cells) Policy input of an (N, cells) array of grids: the one-hot
+    layout of states.ONE_HOT for any board size. 3x3 grids are gathered
+    from ENCODING, as in encode_inputs.
+    """
+    grids = np.asarray(grids)
+    cells = grids.shape[-1]
+    if cells == 9:
+        return encode_inputs(states.encode(grids.reshape(-1, 9)), out)
+    one_hot = grids.reshape(-1, 1, cells) == np.arange(3)[:, None]
+    x = torch.from_numpy(one_hot.reshape(-1, 3 * cells).astype(np.float32))
+    if out is None:
+        return x
+    return out[:x.size(0)].copy_(x)
+
+
+def select_actions(policy, grids, out=None, generator=None):
+    """
+    Samples one action per board from a single forward pass.
+      @param grids: (N, cells) array of grids
+      @param out: optional reusable input buffer with at least N rows
+      @param generator: torch.Generator to sample with instead of the
+                        global one
+      @returns (N,) numpy array of actions and (N,) tensor of log-probs
+    """
+    state = encode_grids(grids, out)
     pr = policy(Variable(state))
     m = torch.distributions.Categorical(pr)
-    action = m.sample()
-    log_prob = torch.sum(m.log_prob(action))
-    return action.data[0], log_prob
+    if generator is None:
+        actions = m.sample()
+    else:
+        actions = torch.multinomial(pr, 1, generator=generator).squeeze(1)
+    return actions.data.numpy(), m.log_prob(actions)
+
+
+def select_action(policy, state, generator=None):
+    """Samples an action from the policy at the state."""
+    actions, log_probs = select_actions(policy, state[None],
+                                        generator=generator)
+    return int(actions[0]), log_probs[0:1]
+
+
+def action_log_probs(policy, grids, actions):
+    """Log-probs the policy gives to actions (N,) at the (N, cells) grids."""
+    pr = policy(Variable(encode_grids(grids)))
+    m = torch.distributions.Categorical(pr)
+    return m.log_prob(torch.from_numpy(np.asarray(actions)).long())
+
+
+def symmetric_log_probs(policy, grids, actions):
+    """
+    Mean log-prob the policy gives to the 8 symmetric images (rotations
+    and reflections, see states.SYMMETRIES) of each (grid, action) pair;
+    one forward pass over all 8N images.
+    """
+    images = np.asarray(grids)[:, states.SYMMETRIES]
+    image_actions = states.INVERSE[:, np.asarray(actions)].T
+    return action_log_probs(policy, images.reshape(-1, 9),
+                            image_actions.reshape(-1)).view(-1, 8).mean(1)
 
 
 def compute_returns(rewards, gamma=1.0):
@@ -154,15 +195,127 @@ def compute_returns(rewards, gamma=1.0):
     >>> compute_returns([0,-0.5,5,0.5,-10], 0.9)
     [-2.5965000000000003, -2.8850000000000002, -2.6500000000000004, -8.5, -10.0]
     """
-    G = [0] * len(rewards)
+    rewards = np.asarray(rewards, dtype=np.float64)
+    return discounted_returns(rewards, [len(rewards)], gamma).tolist()
 
-    for i in reversed(range(len(rewards))):
-        if i == len(rewards) - 1:
-            G[i] = rewards[i] * 1.0
-        else:
-            G[i] = rewards[i] + gamma * G[i + 1]
 
-    return G
+def discounted_returns(rewards, episode_ends, gamma=1.0):
+    """
+    compute_returns for many episodes stored back to back.
+      @param rewards: flat array of the rewards of every step
+      @param episode_ends: index one past the last step of each episode
+      @returns flat array of the returns of every step
+    >>> discounted_returns(np.array([0., 0, 1, 0, 2]), [3, 5], 0.5).tolist()
+    [0.25, 0.5, 1.0, 1.0, 2.0]
+    """
+    ends = np.asarray(episode_ends, dtype=np.int64)
+    lengths = np.diff(np.concatenate([[0], ends]))
+    episode = np.repeat(np.arange(len(ends)), lengths)
+    step = np.arange(len(episode)) - np.repeat(ends - lengths, lengths)
+    # pad to (episodes, longest episode), then sweep back over the steps
+    padded = np.zeros((len(ends), lengths.max() if len(ends) else 0))
+    padded[episode, step] = rewards[:len(episode)]
+    G = np.zeros(len(ends))
+    for t in reversed(range(padded.shape[1])):
+        G = padded[:, t] + gamma * G
+        padded[:, t] = G
+    return padded[episode, step]
+
+
+class TrajectoryBuffer(object):
+    """
+    Preallocated, array-backed storage for the steps of many episodes:
+    board, action, log-prob at sampling time and reward of every step,
+    plus the index where each episode ends. Returns and their
+    per-episode normalization are computed for the whole ragged batch
+    at once.
+    >>> buf = TrajectoryBuffer()
+    >>> buf.add_episode(np.zeros((4, 9)), [0, 1, 2, 3], [0, 0, 0, 1])
+    >>> buf.add_episode(np.zeros((2, 9)), [4, 5], [1, -1])
+    >>> buf.returns(0.9).tolist()
+    [0.7290000000000001, 0.81, 0.9, 1.0, 0.09999999999999998, -1.0]
+    >>> np.round(buf.normalized_returns(0.9), 4).tolist()
+    [-1.1203, -0.4263, 0.3449, 1.2017, 0.7071, -0.7071]
+    """
+    __slots__ = ('states', 'actions', 'log_probs', 'rewards', 'episode_ends',
+                 'size', 'num_episodes')
+
+    def __init__(self, capacity=1024):
+        self.states = np.zeros((capacity, 9), dtype=np.int8)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.log_probs = np.zeros(capacity, dtype=np.float32)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.episode_ends = np.zeros(capacity, dtype=np.int64)
+        self.clear()
+
+    def clear(self):
+        """Forget every stored step, keeping the allocated arrays."""
+        self.size = 0
+        self.num_episodes = 0
+
+    def _reserve(self, n):
+        capacity = len(self.actions)
+        if self.size + n > capacity:
+            capacity = max(2 * capacity, self.size + n)
+            for name in ('states', 'actions', 'log_probs', 'rewards'):
+                old = getattr(self, name)
+                new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:self.size] = old[:self.size]
+                setattr(self, name, new)
+        if self.num_episodes + 1 > len(self.episode_ends):
+            self.episode_ends = np.concatenate(
+                [self.episode_ends, np.zeros_like(self.episode_ends)])
+
+    def add(self, state, action, reward, log_prob=0.0):
+        """Append one step to the current episode."""
+        self._reserve(1)
+        i = self.size
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.log_probs[i] = log_prob
+        self.size += 1
+
+    def end_episode(self):
+        """Close the current episode."""
+        self._reserve(0)
+        self.episode_ends[self.num_episodes] = self.size
+        self.num_episodes += 1
+
+    def add_episode(self, states, actions, rewards, log_probs=None):
+        """Append a whole episode at once."""
+        n = len(rewards)
+        self._reserve(n)
+        i = self.size
+        self.states[i:i + n] = states
+        self.actions[i:i + n] = actions
+        self.rewards[i:i + n] = rewards
+        self.log_probs[i:i + n] = 0.0 if log_probs is None else log_probs
+        self.size += n
+        self.end_episode()
+
+    def episode_lengths(self):
+        """Number of steps of every closed episode."""
+        ends = self.episode_ends[:self.num_episodes]
+        return np.diff(np.concatenate([[0], ends]))
+
+    def returns(self, gamma=1.0):
+        """Discounted return of every step of the closed episodes."""
+        return discounted_returns(self.rewards,
+                                  self.episode_ends[:self.num_episodes], gamma)
+
+    def normalized_returns(self, gamma=1.0):
+        """
+        returns() with each episode's returns shifted and scaled to zero
+        mean and unit (sample) std, as in finish_episode.
+        """
+        G = self.returns(gamma)
+        lengths = self.episode_lengths()
+        episode = np.repeat(np.arange(self.num_episodes), lengths)
+        mean = np.bincount(episode, G) / lengths
+        centered = G - mean[episode]
+        var = np.bincount(episode, centered ** 2) / np.maximum(lengths - 1, 1)
+        return centered / (np.sqrt(var)[episode] + np.finfo(np.float32).eps)
 
 
 def finish_episode(saved_rewards, saved_logprobs, gamma=1.0):
@@ -176,95 +329,621 @@ def finish_episode(saved_rewards, saved_logprobs, gamma=1.0):
     for log_prob, reward in zip(saved_logprobs, returns):
         policy_loss.append(-log_prob * reward)
     policy_loss = torch.cat(policy_loss).sum()
-    policy_loss.backward(retain_graph=True)
-    # note: retain_graph=True allows for multiple calls to .backward()
-    # in a single step
+    # every episode has its own graph, so it can be freed right away
+    policy_loss.backward()
+
+
+def rollout(venv, act, play=None, save_states=False):
+    """
+    Step venv, which must not autoreset, until all of its boards are done.
+      @param act: act(live) returns the actions of the boards in the
+                  boolean mask live, in row order; it is where callers
+                  sample and keep their log-probs
+      @param play: play(venv, actions) to use instead of
+                   VecEnvironment.play_against_random
+      @param save_states: if True, the board of every step is kept too
+      @returns (T, N) object array of statuses, (T, N) boolean mask of the
+          steps each board actually took, (T, N) array of actions and
+          (T, N, 9) array of boards, or None without save_states, where T
+          is the length of the longest episode
+    """
+    actions = np.zeros(venv.num_envs, dtype=np.int64)
+    saved_statuses, masks, saved_actions, saved_states = [], [], [], []
+    while not venv.done.all():
+        live = ~venv.done
+        if save_states:
+            saved_states.append(venv.grid.copy())
+        actions[live] = act(live)
+        if play is None:
+            _, status, _ = venv.play_against_random(actions)
+        else:
+            _, status, _ = play(venv, actions)
+        saved_statuses.append(status)
+        saved_actions.append(actions.copy())
+        masks.append(live)
+    return (np.array(saved_statuses), np.array(masks),
+            np.array(saved_actions),
+            np.array(saved_states) if save_states else None)
+
+
+def collect_episodes(policy, num_episodes, symmetry=False, play=None,
+                     reward=None, invalid=None, buffer=None):
+    """
+    Play num_episodes games against the random agent side by side.
+      @param symmetry: if True, the rollout is sampled without a graph and
+                       each step's log-prob is then recomputed as the mean
+                       over its 8 symmetric images, in one forward pass
+      @param play: play(venv, actions) to use instead of
+                   VecEnvironment.play_against_random
+      @param reward: maps a status to its reward, get_reward by default
+      @param invalid: optional (K,) int array the number of invalid moves
+                      of each episode is added to
+      @param buffer: optional TrajectoryBuffer the episodes are appended
+                     to, with the log-prob of every action at sampling
+                     time; the rollout is then sampled without a graph
+      @returns (T, K) tensor of log-probs, (T, K) array of rewards and
+          (T, K) boolean mask of the steps each episode actually took,
+          where T is the length of the longest episode
+    """
+    if reward is None:
+        reward = get_reward
+    no_grad = symmetry or buffer is not None
+    venv = VecEnvironment(num_episodes, autoreset=False)
+    # the input buffer can only be reused when no graph keeps it alive
+    inputs = torch.empty(num_episodes, 27) if no_grad else None
+    saved_logprobs = []
+
+    def act(live):
+        with torch.set_grad_enabled(not no_grad):
+            actions, logprobs = select_actions(policy, venv.grid[live],
+                                               inputs)
+        rows = torch.from_numpy(np.flatnonzero(live))
+        saved_logprobs.append(
+            torch.zeros(num_episodes).index_copy(0, rows, logprobs))
+        return actions
+
+    statuses, masks, actions, grids = rollout(venv, act, play, no_grad)
+    saved_logprobs = torch.stack(saved_logprobs)
+    saved_rewards = np.zeros(masks.shape)
+    saved_rewards[masks] = [reward(s) for s in statuses[masks]]
+    if invalid is not None:
+        invalid += (statuses == Environment.STATUS_INVALID_MOVE).sum(0)
+    if buffer is not None:
+        # every episode's steps are a prefix of the (T, K) arrays
+        lengths = masks.sum(0)
+        logprobs = saved_logprobs.numpy()
+        for k in range(num_episodes):
+            n = lengths[k]
+            buffer.add_episode(grids[:n, k], actions[:n, k],
+                               saved_rewards[:n, k], logprobs[:n, k])
+    if symmetry:
+        steps, cols = np.nonzero(masks)
+        logprobs = symmetric_log_probs(policy, grids[steps, cols],
+                                       actions[steps, cols])
+        saved_logprobs = torch.zeros(masks.shape).index_put(
+            (torch.from_numpy(steps), torch.from_numpy(cols)), logprobs)
+    return saved_logprobs, saved_rewards, masks
+
+
+def finish_batch(saved_rewards, saved_logprobs, mask, gamma=1.0):
+    """
+    finish_episode for a padded (T, K) batch of K episodes: the returns of
+    each episode are normalized on their own and a single backward pass is
+    run for the whole batch.
+    """
+    returns = np.zeros_like(saved_rewards, dtype=np.float64)
+    G = np.zeros(saved_rewards.shape[1])
+    for t in reversed(range(saved_rewards.shape[0])):
+        G = saved_rewards[t] + gamma * G
+        returns[t] = G
+    returns = torch.from_numpy(returns).float()
+    mask = torch.from_numpy(mask.astype(np.float32))
+    # subtract mean and std of each episode for faster training
+    steps = mask.sum(0)
+    mean = (returns * mask).sum(0) / steps
+    std = ((((returns - mean) ** 2) * mask).sum(0) /
+           (steps - 1).clamp(min=1)).sqrt()
+    returns = (returns - mean) / (std + np.finfo(np.float32).eps)
+    policy_loss = -(saved_logprobs * returns * mask).sum()
+    policy_loss.backward()
+
+
+# reward of each environment status, see get_reward
+REWARDS = {
+    Environment.STATUS_VALID_MOVE: 10,
+    Environment.STATUS_INVALID_MOVE: -500,
+    Environment.STATUS_WIN: 1000,
+    Environment.STATUS_TIE: -20,
+    Environment.STATUS_LOSE: -30
+}
 
 
 def get_reward(status):
     """Returns a numeric given an environment status."""
-    return {
-        Environment.STATUS_VALID_MOVE: 10,
-        Environment.STATUS_INVALID_MOVE: -500,
-        Environment.STATUS_WIN: 1000,
-        Environment.STATUS_TIE: -20,
-        Environment.STATUS_LOSE: -30
-    }[status]
-
-
-def train(policy, env, gamma=0.75, log_interval=1000):
-    """Train policy gradient."""
-    optimizer = optim.Adam(policy.parameters(), lr=0.001)
+    return REWARDS[status]
+
+
+def _record(evaluation):
+    """Append a win_rates result and its first move to the histories."""
+    wins.append(evaluation['win'])
+    loses.append(evaluation['lose'])
+    ties.append(evaluation['tie'])
+    invalids.append(evaluation['rate_invalid'])
+    first_moves.append(evaluation['first_move'])
+
+
+class BackgroundEvaluator(object):
+    """
+    Periodic evaluation and checkpointing on a worker thread.
+
+    submit() snapshots the policy's weights and returns right away; the
+    worker loads each snapshot into its own copy of the policy and runs
+    log_progress on it, which rates it and adds it to the checkpoint
+    store.
+    Snapshots are handled one at a time in the order they were submitted,
+    so the wins/loses/ties/invalids/first_moves histories are still
+    appended in episode order, as are the calls of each snapshot's done
+    callback.
+
+    The games of win_rates draw from generators of the worker's own, seeded
+    with seed, rather than the global ones the training loop uses, so a
+    seeded run does not depend on how the two threads interleave.
+    """
+
+    def __init__(self, policy, eval_games=None, env=None, store=None,
+                 seed=42):
+        self.policy = copy.deepcopy(policy)
+        self.env = Environment() if env is None else env
+        self.env.rng = random.Random(seed)
+        self.generator = torch.Generator().manual_seed(seed)
+        self.rng = np.random.RandomState(seed)
+        self.eval_games = eval_games
+        self.store = CHECKPOINT_STORE if store is None else store
+        self.error = None
+        self._tasks = queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, policy, episode, average_return, evaluate=True,
+               done=None):
+        """
+        Queue the log_progress of policy at episode, rating it if
+        evaluate. Once its checkpoint is stored, done(evaluation) is
+        called on the worker with the win/lose/tie/rate_invalid/first_move
+        dict of train()'s profiler records, empty when not evaluated.
+        """
+        if self.error is not None:
+            raise self.error
+        snapshot = type(policy.state_dict())(
+            (name, t.detach().clone())
+            for name, t in policy.state_dict().items())
+        self._tasks.put((episode, snapshot, average_return, evaluate, done))
+
+    def _run(self):
+        env = self.env
+        while True:
+            task = self._tasks.get()
+            try:
+                if task is None:
+                    return
+                if self.error is None:
+                    self._evaluate(env, *task)
+            except Exception as e:
+                self.error = e
+            finally:
+                self._tasks.task_done()
+
+    def _evaluate(self, env, episode, snapshot, average_return, evaluate,
+                  done):
+        self.policy.load_state_dict(snapshot)
+        evaluation = log_progress(
+            self.policy, episode, average_return, self.store,
+            env if evaluate else None, self.eval_games,
+            generator=self.generator, rng=self.rng)
+        if evaluation:
+            _record(evaluation)
+        if done is not None:
+            done(evaluation)
+
+    def close(self):
+        """Wait for all queued snapshots, then stop the worker."""
+        self._tasks.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def crossed_interval(i_episode, batch_size, interval):
+    """
+    The multiple of interval that the batch of batch_size episodes ending
+    at episode i_episode crosses, or None. Every trainer logs at the
+    batch that crosses each multiple of its log_interval, under that
+    multiple.
+    >>> [crossed_interval(i, 300, 1000) for i in (900, 1200, 1500)]
+    [None, 1000, None]
+    """
+    episode = i_episode // interval * interval
+    return episode if episode > i_episode - batch_size else None
+
+
+def log_progress(policy, episode, average_return, store, env=None,
+                 eval_games=None, profiler=None, generator=None, rng=None,
+                 name=None):
+    """
+    What every trainer does at each log_interval: with env, rate the
+    policy with win_rates (eval_games, generator and rng are passed on)
+    and take its first move; print that and the average return on one
+    line, after name if given; and add a checkpoint of the policy to
+    store, a CheckpointStore or the path of one. profiler, if given,
+    times the 'evaluate' and 'checkpoint' phases. Returns the evaluation,
+    empty without env.
+    """
+    if profiler is None:
+        profiler = profiling.Profiler()
+    line = 'Episode {}\tAverage return: {:.2f}'.format(episode,
+                                                      average_return)
+    evaluation = {}
+    if env is not None:
+        with profiler.phase('evaluate'), torch.no_grad():
+            evaluation = win_rates(env, policy, eval_games, generator, rng)
+            evaluation['first_move'] = int(
+                np.argmax(first_move_distr(policy, env)))
+        line += ('\tfirst move: {first_move}\twin: {win:.4f}\t'
+                 'lose: {lose:.4f}\ttie: {tie:.4f}\t'
+                 'invalid: {rate_invalid:.4f}'.format(**evaluation))
+    print(line if name is None else name + '\t' + line)
+    with profiler.phase('checkpoint'):
+        if not isinstance(store, checkpoints.CheckpointStore):
+            store = checkpoints.open_store(store)
+        store.add(policy.state_dict(), episode,
+                  getattr(policy, 'mask_illegal', False))
+    return evaluation
+
+
+def _make_optimizer(policy, batch_size=1, lr=0.001):
+    """
+    Adam optimizer of policy and its scheduler, which multiplies the
+    learning rate by 0.9 every 10000 episodes of batch_size.
+    """
+    optimizer = optim.Adam(policy.parameters(), lr=lr)
     scheduler = torch.optim.lr_scheduler.StepLR(
-        optimizer, step_size=10000, gamma=0.9)
+        optimizer, step_size=max(1, 10000 // batch_size), gamma=0.9)
+    return optimizer, scheduler
+
+
+def _check_board(env, what):
+    """Raise ValueError unless env is the plain 3x3 board what needs."""
+    if (env.m, env.n, env.k, env.gravity) != (3, 3, 3, False):
+        raise ValueError("%s needs the 3x3 board, not %dx%d with "
+                         "k=%d%s" % (what, env.m, env.n, env.k,
+                                     " and gravity" if env.gravity else ""))
+
+
+def train(policy, env, gamma=0.75, log_interval=1000, batch_size=1,
+          eval_games=None, symmetry=False, num_episodes=60000, profile=None,
+          background=False, callback=None, store=None):
+    """
+    Train policy gradient.
+
+    With batch_size > 1, batch_size episodes are played side by side and
+    the policy takes one optimizer step per batch; logging and
+    checkpoints happen after the batch that crosses each multiple of
+    log_interval, under that multiple. At every log_interval the policy
+    is rated by win_rates over eval_games games (see there for the
+    default), and the histories get its win/lose/tie rates and mean
+    invalid moves per game. With symmetry, every step is
+    trained on as all 8 of its symmetric images (see symmetric_log_probs).
+    Training stops after the first batch past num_episodes. env may be an
+    MNKEnvironment (with a Policy.for_environment policy) when batch_size
+    is 1 and symmetry is off; the rest is specific to the 3x3 board and
+    raises ValueError for any other.
+
+    With profile set to a file name, the time spent in each phase of the
+    loop and the episode lengths and invalid moves are appended to it as
+    one JSON record per log_interval (see profiling.py).
+
+    With background, the periodic win_rates/first_move_distr and checkpoint
+    writes run on a BackgroundEvaluator thread while training goes on;
+    the histories, and the profile records, which get the win_rates results
+    once they are in, are complete when train() returns.
+
+    callback(i_episode, policy) is called at every log_interval; training
+    stops early when it returns True. Checkpoints go to the store at path
+    store, CHECKPOINT_STORE by default.
+    """
+    if batch_size > 1:
+        _check_board(env, 'batch_size > 1')
+    if symmetry:
+        _check_board(env, 'symmetry')
+    if store is None:
+        store = CHECKPOINT_STORE
+    profiler = profiling.Profiler(profile)
+    evaluator = None
+    if background:
+        evaluator = BackgroundEvaluator(
+            policy, eval_games,
+            make_environment(env.m, env.n, env.k, env.gravity), store)
+    optimizer, scheduler = _make_optimizer(policy, batch_size)
     running_reward = 0
+    running_episodes = 0
     # inv_move = []
-    for i_episode in count(1):
-        saved_rewards = []
-        saved_logprobs = []
-        state = env.reset()
-        done = False
-        while not done:
-            action, logprob = select_action(policy, state)
-            state, status, done = env.play_against_random(action)
-            reward = get_reward(status)
-            saved_logprobs.append(logprob)
-            saved_rewards.append(reward)
-
-        R = compute_returns(saved_rewards)[0]
-        running_reward += R
-
-        finish_episode(saved_rewards, saved_logprobs, gamma)
-
-        if i_episode <= 60000 and i_episode % log_interval == 0:
-            avg_return.append(running_reward / log_interval)
-            episodes.append(i_episode)
-            win, lose, tie, invalid = rate(env, policy)
-            wins.append(win)
-            loses.append(lose)
-            ties.append(tie)
-            invalids.append(invalid)
-            first_moves.append(np.argmax(first_move_distr(policy, env)))
-            print(np.argmax(first_move_distr(policy, env)))
-            print('win:', win)
-            print('lose:', lose)
-            print('tie:', tie)
+    for i_batch in count(1):
+        i_episode = i_batch * batch_size
+        if batch_size == 1:
+            saved_rewards = []
+            saved_logprobs = []
+            saved_states = []
+            saved_actions = []
+            invalid = 0
+            with profiler.phase('rollout'):
+                state = env.reset()
+                done = False
+                while not done:
+                    with torch.set_grad_enabled(not symmetry):
+                        action, logprob = select_action(policy, state)
+                    saved_states.append(state.copy())
+                    saved_actions.append(action)
+                    state, status, done = env.play_against_random(action)
+                    invalid += status == env.STATUS_INVALID_MOVE
+                    reward = get_reward(status)
+                    saved_logprobs.append(logprob)
+                    saved_rewards.append(reward)
+                if symmetry:
+                    saved_logprobs = list(symmetric_log_probs(
+                        policy, saved_states, saved_actions).split(1))
+            profiler.episodes_done([len(saved_rewards)], invalid)
 
-        if i_episode % log_interval == 0:
-            print('Episode {}\tAverage return: {:.2f}'.format(
-                i_episode,
-                running_reward / log_interval))
+            R = compute_returns(saved_rewards)[0]
+            running_reward += R
+
+            with profiler.phase('backward'):
+                finish_episode(saved_rewards, saved_logprobs, gamma)
+        else:
+            invalid = np.zeros(batch_size, dtype=np.int64)
+            with profiler.phase('rollout'):
+                saved_logprobs, saved_rewards, mask = collect_episodes(
+                    policy, batch_size, symmetry, invalid=invalid)
+            profiler.episodes_done(mask.sum(0), invalid.sum())
+            running_reward += saved_rewards.sum()
+
+            with profiler.phase('backward'):
+                finish_batch(saved_rewards, saved_logprobs, mask, gamma)
+            del saved_logprobs
+
+        running_episodes += batch_size
+        log_episode = crossed_interval(i_episode, batch_size, log_interval)
+        if log_episode is not None:
+            average = running_reward / float(running_episodes)
+            evaluate = log_episode <= num_episodes
+            if evaluate:
+                avg_return.append(average)
+                episodes.append(log_episode)
+            if evaluator is not None:
+                # the record is written by the evaluator, with its results
+                rec = profiler.take(log_episode, avg_return=float(average))
+                with profiler.phase('evaluate'):
+                    evaluator.submit(
+                        policy, log_episode, average, evaluate,
+                        done=lambda evaluation, rec=rec: profiler.write(
+                            rec, **evaluation))
+            else:
+                evaluation = log_progress(
+                    policy, log_episode, average, store,
+                    env if evaluate else None, eval_games, profiler)
+                if evaluation:
+                    _record(evaluation)
+                profiler.record(log_episode, avg_return=float(average),
+                                **evaluation)
             running_reward = 0
-            torch.save(policy.state_dict(),
-                       "testing/policy-%d.pkl" % i_episode)
+            running_episodes = 0
+            if callback is not None and callback(log_episode, policy):
+                break
 
-        if i_episode % 1 == 0:  # batch_size
+        with profiler.phase('optimizer'):
             optimizer.step()
             scheduler.step()
             optimizer.zero_grad()
 
-        if i_episode == 60001:
+        if i_episode > num_episodes:
             break
+    if evaluator is not None:
+        with profiler.phase('evaluate'):
+            evaluator.close()
+    profiler.close()
+
+
+def _train_on_batches(policy, env, update, batch_size, log_interval,
+                      num_episodes, eval_games, lr, callback, store):
+    """
+    Loop shared by train_ppo and train_actor_critic: collect batch_size
+    episodes into a TrajectoryBuffer, let update(buffer, optimizer) take
+    the optimizer steps of the batch, decay the learning rate as in
+    train(), and rate and checkpoint the policy at every log_interval.
+    """
+    optimizer, scheduler = _make_optimizer(policy, batch_size, lr)
+    buffer = TrajectoryBuffer()
+    running_reward = 0
+    running_episodes = 0
+    i_episode = 0
+    while i_episode < num_episodes:
+        buffer.clear()
+        collect_episodes(policy, batch_size, buffer=buffer)
+        running_reward += buffer.rewards[:buffer.size].sum()
+        running_episodes += batch_size
+        update(buffer, optimizer)
+        scheduler.step()
+
+        i_episode += batch_size
+        log_episode = crossed_interval(i_episode, batch_size, log_interval)
+        if log_episode is not None:
+            log_progress(policy, log_episode,
+                         running_reward / running_episodes, store, env,
+                         eval_games)
+            running_reward = 0
+            running_episodes = 0
+            if callback is not None and callback(log_episode, policy):
+                break
+    return policy
+
+
+def train_ppo(policy, env, gamma=0.75, log_interval=1000, batch_size=50,
+              epochs=4, clip=0.2, minibatch_size=64, num_episodes=60000,
+              eval_games=None, lr=0.001, callback=None, store=None):
+    """
+    Train with clipped-surrogate (PPO-style) updates instead of one
+    REINFORCE step per batch.
+
+    Each batch of batch_size episodes is stored in a TrajectoryBuffer with
+    the log-prob of every action when it was sampled, and then reused for
+    epochs passes of updates on shuffled minibatches of minibatch_size
+    steps (None for the whole batch). Each update maximizes
+        min(r A, clip(r, 1 - clip, 1 + clip) A)
+    where r is the ratio of the current to the old probability of the
+    action and A the per-episode normalized return, as in finish_episode.
+    The learning rate decays as in train(), once per batch; callback is as
+    for train(). Checkpoints go to the store at path store, by default
+    ppo.bin next to CHECKPOINT_STORE so they do not replace train()'s
+    under the same keys. Only the 3x3 board is supported.
+    """
+    _check_board(env, 'train_ppo')
+    if store is None:
+        store = os.path.join(os.path.dirname(CHECKPOINT_STORE), 'ppo.bin')
+
+    def update(buffer, optimizer):
+        n = buffer.size
+        advantages = torch.from_numpy(buffer.normalized_returns(gamma)).float()
+        old_logprobs = torch.from_numpy(buffer.log_probs[:n])
+        step = n if minibatch_size is None else minibatch_size
+        for _ in range(epochs):
+            order = np.random.permutation(n)
+            for start in range(0, n, step):
+                idx = order[start:start + step]
+                logprobs = action_log_probs(policy, buffer.states[idx],
+                                            buffer.actions[idx])
+                ratio = torch.exp(logprobs - old_logprobs[idx])
+                A = advantages[idx]
+                surrogate = torch.min(ratio * A,
+                                      ratio.clamp(1 - clip, 1 + clip) * A)
+                optimizer.zero_grad()
+                (-surrogate.sum()).backward()
+                optimizer.step()
+
+    return _train_on_batches(policy, env, update, batch_size, log_interval,
+                             num_episodes, eval_games, lr, callback, store)
+
+
+def train_actor_critic(policy, env, gamma=0.75, log_interval=1000,
+                       batch_size=10, gae_lambda=None, value_coef=0.5,
+                       value_scale=100.0, num_episodes=60000, eval_games=None,
+                       lr=0.001, callback=None, store=None):
+    """
+    Train an ActorCritic with its value head as the baseline.
+
+    Each batch of batch_size episodes gets one update. The critic regresses
+    the discounted returns, divided by value_scale to keep them near unit
+    size, with a Huber loss weighted by value_coef. The actor's advantage
+    is the return minus the predicted value or, with gae_lambda, the
+    generalized advantage estimate
+        A_t = sum_k (gamma lambda)^k (r_{t+k} + gamma V_{t+k+1} - V_{t+k})
+    normalized over the batch. Checkpoints go to the store at path store,
+    by default actor-critic.bin next to CHECKPOINT_STORE; callback is as
+    for train(). Only the 3x3 board is supported.
+    """
+    _check_board(env, 'train_actor_critic')
+    if store is None:
+        store = os.path.join(os.path.dirname(CHECKPOINT_STORE),
+                             'actor-critic.bin')
+
+    def update(buffer, optimizer):
+        n = buffer.size
+        ends = buffer.episode_ends[:buffer.num_episodes]
+        returns = buffer.returns(gamma) / value_scale
+
+        probs, values = policy.policy_and_value(
+            Variable(encode_inputs(states.encode(buffer.states[:n]))))
+        logprobs = torch.distributions.Categorical(probs).log_prob(
+            torch.from_numpy(buffer.actions[:n]))
+        V = values.detach().numpy().astype(np.float64)
+        if gae_lambda is None:
+            advantages = returns - V
+        else:
+            # value of the next state, zero past the end of each episode
+            next_V = np.append(V[1:], 0.0)
+            next_V[ends - 1] = 0.0
+            deltas = buffer.rewards[:n] / value_scale + gamma * next_V - V
+            advantages = discounted_returns(deltas, ends, gamma * gae_lambda)
+        advantages = ((advantages - advantages.mean()) /
+                      (advantages.std() + np.finfo(np.float32).eps))
+
+        actor_loss = -(logprobs * torch.from_numpy(advantages).float()).sum()
+        critic_loss = F.smooth_l1_loss(
+            values, torch.from_numpy(returns).float(), reduction='sum')
+        (actor_loss + value_coef * critic_loss).backward()
+        optimizer.step()
+        optimizer.zero_grad()
+
+    return _train_on_batches(policy, env, update, batch_size, log_interval,
+                             num_episodes, eval_games, lr, callback, store)
+
+
+def episodes_to_target(trainer, policy, target=0.8, max_episodes=60000,
+                       check_interval=1000, **kwargs):
+    """
+    Train policy with trainer (train, train_ppo or train_actor_critic) and
+    return the first episode, checked every check_interval, at which its
+    exact win rate against the random agent (see exact.py) reaches
+    target, or None if it has not by max_episodes. Checkpoints go to a
+    temporary store.
+    """
+    import shutil
+    import tempfile
+    import exact
+    reached = []
+
+    def check(i_episode, policy):
+        if exact.exact_rate(policy)['win'] >= target:
+            reached.append(i_episode)
+            return True
+        return False
+
+    tmp = tempfile.mkdtemp()
+    store = os.path.join(tmp, 'checkpoints.bin')
+    try:
+        trainer(policy, Environment(), log_interval=check_interval,
+                num_episodes=max_episodes, callback=check, store=store,
+                **kwargs)
+    finally:
+        checkpoints.close_store(store)
+        shutil.rmtree(tmp)
+    return reached[0] if reached else None
 
 
 def first_move_distr(policy, env):
     """Display the distribution of first moves."""
-    state = env.reset()
-    state = torch.from_numpy(state).long().unsqueeze(0)
-    state = torch.zeros(3, 9).scatter_(0, state, 1).view(1, 27)
-    pr = policy(Variable(state))
+    pr = policy(Variable(encode_grids(env.reset()[None])))
     return pr.data
 
 
 def load_weights(policy, episode):
-    """Load saved weights"""
+    """
+    Load saved weights, from the checkpoint store (with the policy's
+    mask_illegal flag) or an old pickle
+    """
+    hidden = policy.affine1.out_features
+    if os.path.exists(CHECKPOINT_STORE):
+        store = checkpoints.open_store(CHECKPOINT_STORE)
+        if (hidden, episode) in store:
+            store.load_into(policy, episode)
+            return
     weights = torch.load("testing/policy-%d.pkl" % episode)
     policy.load_state_dict(weights)
 
 
 def baby_play(env, policy):
-    action, logp = select_action(policy, env.grid)
-    env.step(action)
+    with torch.no_grad():
+        actions, _ = select_actions(policy, env.grid[None])
+    env.step(int(actions[0]))
     env.render()
 
 
@@ -274,13 +953,92 @@ def me_play(env, action):
     env.render()
 
 
-def rate(env, policy, flag=0):
+def play_games(policy, num_games, generator=None, rng=None):
+    """
+    Play num_games against the random agent side by side, with one batched
+    forward pass per move over the distinct boards of the games still
+    going. Returns the final status and the number of invalid moves of
+    every game. The policy's moves are sampled with uniforms from the
+    torch.Generator generator and the random agent's with the numpy
+    RandomState rng, the global ones by default.
+    """
+    venv = VecEnvironment(num_games, autoreset=False, rng=rng)
+    final = np.empty(num_games, dtype=np.int8)
+    invalid = np.zeros(num_games, dtype=np.int64)
+    # row indices of the games still going; finished ones are dropped
+    live = np.arange(num_games)
+    with torch.no_grad():
+        while len(live):
+            # one forward pass per distinct board rather than per game
+            ids, inverse = np.unique(venv.state[live], return_inverse=True)
+            probs = policy(encode_inputs(ids)).double().numpy()
+            u = torch.rand(len(live), generator=generator,
+                           dtype=torch.float64).numpy()
+            actions = inference.inverse_cdf(probs[inverse], u)
+            codes = venv.play_rows_against_random(live, actions)
+            invalid[live] += codes == venv.CODE_INVALID_MOVE
+            finished = venv.done[live]
+            final[live[finished]] = codes[finished]
+            live = live[~finished]
+    return venv.STATUSES[final], invalid
+
+
+def wilson_interval(successes, n, z=1.96):
+    """
+    Wilson score confidence interval for a binomial proportion.
+    >>> [round(x, 4) for x in wilson_interval(50, 100)]
+    [0.4038, 0.5962]
+    >>> [round(x, 4) for x in wilson_interval(0, 100)]
+    [0.0, 0.037]
+    """
+    p = float(successes) / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half = (z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) /
+            (1 + z * z / n))
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+def evaluate(policy, num_games=20000, z=1.96, generator=None, rng=None):
+    """
+    Rate the policy over num_games batched games against the random agent;
+    generator and rng are as for play_games.
+      @returns dict with the win/lose/tie rates and the mean number of
+          invalid moves per game, each mapped to (estimate, low, high)
+          where [low, high] is the z-sigma confidence interval
+    """
+    final, invalid = play_games(policy, num_games, generator, rng)
+    result = {}
+    for key, status in (('win', Environment.STATUS_WIN),
+                        ('lose', Environment.STATUS_LOSE),
+                        ('tie', Environment.STATUS_TIE)):
+        k = int((final == status).sum())
+        result[key] = (float(k) / num_games,) + wilson_interval(
+            k, num_games, z)
+    mean = float(invalid.mean())
+    half = z * float(invalid.std(ddof=1)) / math.sqrt(num_games)
+    result['invalid'] = (mean, max(0.0, mean - half), mean + half)
+    return result
+
+
+def rate(env, policy, flag=0, games=100, generator=None, rng=None):
+    """
+    Win, lose, tie and invalid move counts of the policy over games
+    against the random agent. generator and rng are as for play_games;
+    games played one at a time draw the random agent's moves from env.rng.
+    """
+    if flag != 1 and not isinstance(env, MNKEnvironment):
+        # nothing to render, so play all sessions at once
+        final, invalid = play_games(policy, games, generator, rng)
+        return (int((final == env.STATUS_WIN).sum()),
+                int((final == env.STATUS_LOSE).sum()),
+                int((final == env.STATUS_TIE).sum()),
+                int(invalid.sum()))
     win = 0
     lose = 0
     tie = 0
     invalid = 0
     round_count = 0
-    for session in range(100):
+    for session in range(games):
         if (flag == 1) and round_count <= 5:
             print("========Round%d========" % session)
             round_count += 1
@@ -288,7 +1046,7 @@ def rate(env, policy, flag=0):
         done = False
         status = env.STATUS_VALID_MOVE
         while not done:
-            action, logprob = select_action(policy, state)
+            action, logprob = select_action(policy, state, generator)
             state, status, done = env.play_against_random(action)
             if flag == 1 and round_count <= 5:
                 env.render()
@@ -304,24 +1062,79 @@ def rate(env, policy, flag=0):
     return win, lose, tie, invalid
 
 
-if __name__ == '__main__':
-    import sys
-
-    if len(sys.argv) == 4:
-        if sys.argv[1]=='-l':
-            env = Environment()
-            policy = Policy(hidden_size=int(sys.argv[2]))
-            # `python tictactoe.py -l <hidden-units-size> <ep>` to print the first move distribution
-            ep = int(sys.argv[3])
-            load_weights(policy, ep)
-            print(first_move_distr(policy, env))
-            print(np.argmax(first_move_distr(policy, env)))
-            print("Rates:", rate(env, policy))
+def win_rates(env, policy, games=None, generator=None, rng=None):
+    """
+    What the trainers log at every log_interval: the win, lose and tie
+    rates and mean invalid moves per game ('rate_invalid') of the policy
+    against the random agent. On the 3x3 board this is evaluate() over
+    games, 20000 by default; other boards have no batched engine, so
+    rate() plays games, 100 by default, one at a time.
+    """
+    if isinstance(env, MNKEnvironment):
+        games = 100 if games is None else games
+        counts = rate(env, policy, games=games, generator=generator)
+        win, lose, tie, invalid = [c / float(games) for c in counts]
     else:
+        result = evaluate(policy, 20000 if games is None else games,
+                          generator=generator, rng=rng)
+        win, lose, tie, invalid = [result[key][0] for key in
+                                   ('win', 'lose', 'tie', 'invalid')]
+    return {'win': win, 'lose': lose, 'tie': tie, 'rate_invalid': invalid}
+
+
+if __name__ == '__main__':
+    # `python tictactoe.py -l <hidden-units-size> <ep>` to print the first
+    # move distribution is answered at the top of this file, without torch
+    if len(sys.argv) == 3 and sys.argv[1] == 'ppo':
+        # `python tictactoe.py ppo <hidden-units-size>` to train with
+        # clipped-surrogate updates, see train_ppo; checkpoints go to ppo.bin
+        policy = Policy(hidden_size=int(sys.argv[2]),
+                        mask_illegal=os.environ.get('TTT_MASK') == '1')
+        train_ppo(policy, Environment())
+    elif len(sys.argv) in (3, 4) and sys.argv[1] == 'compare':
+        # `python tictactoe.py compare <hidden-units-size> [<target>]` for
+        # the episodes each trainer needs to reach the exact win rate target
+        hidden = int(sys.argv[2])
+        target = float(sys.argv[3]) if len(sys.argv) == 4 else 0.8
+        runs = [('REINFORCE', train, Policy, {}),
+                ('REINFORCE, batch 10', train, Policy, {'batch_size': 10}),
+                ('actor-critic', train_actor_critic, ActorCritic,
+                 {'batch_size': 1}),
+                ('actor-critic, batch 10', train_actor_critic, ActorCritic,
+                 {}),
+                ('actor-critic, batch 10, GAE 0.9', train_actor_critic,
+                 ActorCritic, {'gae_lambda': 0.9})]
+        results = []
+        for name, trainer, model, kwargs in runs:
+            torch.manual_seed(42)
+            np.random.seed(42)
+            random.seed(42)
+            results.append((name, episodes_to_target(
+                trainer, model(hidden_size=hidden), target, **kwargs)))
+        for name, n in results:
+            print('{:<32} {}'.format(name, n if n is not None else
+                                     'not reached in 60000 episodes'))
+    elif len(sys.argv) in (6, 7) and sys.argv[1] == 'mnk':
+        # `python tictactoe.py mnk <m> <n> <k> <hidden-units-size> [gravity]`
+        # to train on an m x n board where k in a row wins
+        m, n, k, hidden = [int(a) for a in sys.argv[2:6]]
+        gravity = sys.argv[6:] == ['gravity']
+        env = make_environment(m, n, k, gravity)
+        policy = Policy.for_environment(
+            env, hidden, mask_illegal=os.environ.get('TTT_MASK') == '1')
+        train(policy, env, store="testing/checkpoints-{}x{}k{}{}.bin".format(
+            m, n, k, 'g' if gravity else ''))
+    elif len(sys.argv) != 4:
+        import matplotlib.pyplot as plt
+
         # # `python tictactoe.py <hidden-units-size>` to train
         env = Environment()
-        policy = Policy(hidden_size=int(sys.argv[1]))
-        train(policy, env)
+        # TTT_MASK=1 to train with illegal moves masked out, see Policy
+        policy = Policy(hidden_size=int(sys.argv[1]),
+                        mask_illegal=os.environ.get('TTT_MASK') == '1')
+        # TTT_PROFILE=<file> to record per-phase timings, see profiling.py
+        train(policy, env, profile=os.environ.get('TTT_PROFILE'),
+              background=True)
         plt.plot(episodes, avg_return, label="Episode VS Average Return")
         plt.title('Hidden Unit: ' + sys.argv[1])
         plt.xlabel('Episode')
@@ -334,9 +1147,9 @@ if __name__ == '__main__':
 
             print("=============5c==============")
             plt.plot(episodes, invalids, label="Invalid")
-            plt.title('Invalid move counts vs episode')
+            plt.title('Invalid moves per game vs episode')
             plt.xlabel('Episode')
-            plt.ylabel("Counts")
+            plt.ylabel("Invalid moves per game")
             plt.legend()
             plt.savefig("part5c" + ".jpg")
             print("Part5c image saved")
@@ -354,22 +1167,25 @@ if __name__ == '__main__':
             plt.plot(episodes, wins, label="Win")
             plt.plot(episodes, loses, label="Lose")
             plt.plot(episodes, ties, label="Tie")
-            plt.title('WIN/LOSE/TIE counts vs episodes')
+            plt.title('WIN/LOSE/TIE rates vs episodes')
             plt.xlabel('Episode')
-            plt.ylabel("Counts")
+            plt.ylabel("Rate")
             plt.legend()
             plt.savefig("part6" + ".jpg")
             print("Part6 image saved")
             plt.close()
 
             print("=============7==============")
-            policy = Policy(hidden_size=int(sys.argv[1]))
+            import sweep
             episodes=list(range(1000,61000,1000))
+            # all 60 checkpoints in one batched pass
+            distr = sweep.sweep_checkpoints(
+                checkpoints.open_store(CHECKPOINT_STORE), int(sys.argv[1]),
+                episodes)['first_move']
             episodes.insert(0,0)
-            for episode in range(1000,61000,1000):
-                load_weights(policy, episode)
-                for i in range(9):
-                    first_moves[i].append(first_moves[i][-1] + first_move_distr(policy, env)[0][i])
+            for i in range(9):
+                first_moves[i].extend(first_moves[i][-1] +
+                                      np.cumsum(distr[:, i]))
             plt.plot(episodes, first_moves[0], label=str(0))
             plt.plot(episodes, first_moves[1], label=str(1))
             plt.plot(episodes, first_moves[2], label=str(2))
@@ -0,0 +1,239 @@
+"""
+Train several Policy configurations in one run.
+
+A configuration is a hidden size, gamma, learning rate and reward table
+(a name from REWARD_TABLES, or a JSON file mapping every status string
+of Environment, e.g. "inv", to a reward). Configurations are split into
+groups, one per worker process; the configurations of a group play on
+a single VecEnvironment, each on its own batch_size rows, so every
+environment step serves all of them and each policy still gets one
+batched forward pass per step. Updates are finish_batch, as in
+train(batch_size=...).
+
+Every configuration gets a directory under the output directory with its
+checkpoint store and a metrics.jsonl file of profiling.Profiler records
+(average return and win_rates results at every log_interval); a summary of
+all configurations, with their exact final rates, goes to summary.json.
+
+`python train_sweep.py --hidden 64 128 256 [--gamma ...] [--lr ...]
+[--rewards ...] [--episodes 60000] [--workers N] [--out sweep]`
+"""
+from __future__ import print_function
+import contextlib
+import itertools
+import json
+import os
+import random
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+import checkpoints
+import profiling
+import tictactoe
+from tictactoe import Environment, Policy, VecEnvironment
+
+REWARD_TABLES = {
+    'default': tictactoe.REWARDS,
+    # no shaping for valid moves, and a cheaper invalid move
+    'sparse': {Environment.STATUS_VALID_MOVE: 0,
+               Environment.STATUS_INVALID_MOVE: -100,
+               Environment.STATUS_WIN: 1000,
+               Environment.STATUS_TIE: -20,
+               Environment.STATUS_LOSE: -30},
+}
+
+
+def config_name(config):
+    """Directory name of a configuration."""
+    return 'h{hidden}-g{gamma}-lr{lr}-{rewards}'.format(
+        hidden=config['hidden'], gamma=config['gamma'], lr=config['lr'],
+        rewards=os.path.splitext(os.path.basename(config['rewards']))[0])
+
+
+def reward_table(name):
+    """Reward table of a REWARD_TABLES name or a JSON file."""
+    if name in REWARD_TABLES:
+        return REWARD_TABLES[name]
+    with open(name) as f:
+        return json.load(f)
+
+
+def make_configs(hidden_sizes, gammas=(0.75,), lrs=(0.001,),
+                 rewards=('default',)):
+    """Every combination of the given values, as a list of dicts."""
+    return [{'hidden': h, 'gamma': g, 'lr': lr, 'rewards': r}
+            for h, g, lr, r in itertools.product(hidden_sizes, gammas, lrs,
+                                                 rewards)]
+
+
+def collect_group(policies, tables, batch_size, venv):
+    """
+    collect_episodes for several policies on one VecEnvironment, each on
+    its own batch_size rows. Returns, per policy, the (T, K) log-probs,
+    rewards and mask, T being the longest episode of the whole group, and
+    the number of invalid moves.
+    """
+    venv.reset()
+    n = len(policies)
+    blocks = [slice(i * batch_size, (i + 1) * batch_size) for i in range(n)]
+    saved_logprobs = [[] for _ in range(n)]
+
+    def act(live):
+        actions = []
+        for i, policy in enumerate(policies):
+            rows = np.flatnonzero(live[blocks[i]])
+            logprobs = torch.zeros(batch_size)
+            if len(rows):
+                a, lp = tictactoe.select_actions(
+                    policy, venv.grid[blocks[i]][rows])
+                actions.append(a)
+                logprobs = logprobs.index_copy(0, torch.from_numpy(rows), lp)
+            saved_logprobs[i].append(logprobs)
+        return np.concatenate(actions)
+
+    statuses, masks, _, _ = tictactoe.rollout(venv, act)
+    batches = []
+    for i in range(n):
+        status, mask = statuses[:, blocks[i]], masks[:, blocks[i]]
+        rewards = np.zeros(mask.shape)
+        rewards[mask] = [tables[i][s] for s in status[mask]]
+        invalid = (status == Environment.STATUS_INVALID_MOVE).sum()
+        batches.append((torch.stack(saved_logprobs[i]), rewards, mask,
+                        invalid))
+    return batches
+
+
+def train_group(configs, num_episodes=60000, batch_size=50,
+                log_interval=1000, eval_games=None, out_dir='sweep',
+                seed=42):
+    """
+    Train the configurations together, as described above; returns one
+    summary dict per configuration.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    policies = [Policy(hidden_size=c['hidden']) for c in configs]
+    tables = [reward_table(c['rewards']) for c in configs]
+    optimizers, schedulers = zip(*[
+        tictactoe._make_optimizer(p, batch_size, c['lr'])
+        for p, c in zip(policies, configs)])
+    dirs = [os.path.join(out_dir, config_name(c)) for c in configs]
+    for d in dirs:
+        if not os.path.isdir(d):
+            os.makedirs(d)
+    stores = [checkpoints.CheckpointStore(os.path.join(d, 'checkpoints.bin'))
+              for d in dirs]
+    profilers = [profiling.Profiler(os.path.join(d, 'metrics.jsonl'))
+                 for d in dirs]
+    venv = VecEnvironment(len(configs) * batch_size, autoreset=False)
+    env = Environment()
+    running = np.zeros(len(configs))
+    running_episodes = 0
+
+    for i_batch in itertools.count(1):
+        i_episode = i_batch * batch_size
+        if i_episode > num_episodes:
+            break
+        # the rollout is shared, so it counts for every configuration
+        with contextlib.ExitStack() as stack:
+            for profiler in profilers:
+                stack.enter_context(profiler.phase('rollout'))
+            batches = collect_group(policies, tables, batch_size, venv)
+        running_episodes += batch_size
+        for i, (logprobs, rewards, mask, invalid) in enumerate(batches):
+            running[i] += rewards.sum()
+            profilers[i].episodes_done(mask.sum(0), invalid)
+            with profilers[i].phase('backward'):
+                tictactoe.finish_batch(rewards, logprobs, mask,
+                                       configs[i]['gamma'])
+            with profilers[i].phase('optimizer'):
+                optimizers[i].step()
+                schedulers[i].step()
+                optimizers[i].zero_grad()
+        log_episode = tictactoe.crossed_interval(i_episode, batch_size,
+                                                 log_interval)
+        if log_episode is not None:
+            for i, policy in enumerate(policies):
+                average = running[i] / running_episodes
+                evaluation = tictactoe.log_progress(
+                    policy, log_episode, average, stores[i], env, eval_games,
+                    profilers[i], name=config_name(configs[i]))
+                profilers[i].record(log_episode, avg_return=average,
+                                    **evaluation)
+            running[:] = 0
+            running_episodes = 0
+
+    import exact
+    summaries = []
+    for config, policy, profiler in zip(configs, policies, profilers):
+        profiler.close()
+        summary = dict(config, name=config_name(config))
+        summary.update(exact.exact_rate(policy))
+        summaries.append(summary)
+    return summaries
+
+
+def _train_group(args):
+    # pool workers share the machine, so each keeps to one torch thread
+    torch.set_num_threads(1)
+    configs, kwargs = args
+    return train_group(configs, **kwargs)
+
+
+def train_sweep(configs, num_workers=None, **kwargs):
+    """
+    Train the configurations in num_workers processes (at most one per
+    configuration), each training its share as one group; kwargs go to
+    train_group. Writes and returns the summaries of all configurations.
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, len(configs)))
+    groups = [configs[i::num_workers] for i in range(num_workers)]
+    kwargs = dict(kwargs)
+    out_dir = kwargs.setdefault('out_dir', 'sweep')
+    if num_workers == 1:
+        results = [train_group(groups[0], **kwargs)]
+    else:
+        pool = mp.get_context('spawn').Pool(num_workers)
+        try:
+            results = pool.map(_train_group, [(g, kwargs) for g in groups])
+        finally:
+            pool.close()
+            pool.join()
+    summaries = [s for group in results for s in group]
+    summaries.sort(key=lambda s: configs.index(
+        dict((k, s[k]) for k in ('hidden', 'gamma', 'lr', 'rewards'))))
+    with open(os.path.join(out_dir, 'summary.json'), 'w') as f:
+        json.dump(summaries, f, indent=2)
+    return summaries
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--hidden', type=int, nargs='+',
+                        default=[64, 128, 256])
+    parser.add_argument('--gamma', type=float, nargs='+', default=[0.75])
+    parser.add_argument('--lr', type=float, nargs='+', default=[0.001])
+    parser.add_argument('--rewards', nargs='+', default=['default'],
+                        help='names from REWARD_TABLES or JSON files')
+    parser.add_argument('--episodes', type=int, default=60000)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--log-interval', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default='sweep')
+    args = parser.parse_args()
+
+    configs = make_configs(args.hidden, args.gamma, args.lr, args.rewards)
+    summaries = train_sweep(configs, args.workers,
+                            num_episodes=args.episodes,
+                            batch_size=args.batch_size,
+                            log_interval=args.log_interval,
+                            out_dir=args.out)
+    for s in summaries:
+        print('{name:<40} win: {win:.4f}\tlose: {lose:.4f}\t'
+              'tie: {tie:.4f}\tinvalid: {invalid:.4f}'.format(**s))